@@ -0,0 +1,3 @@
+from .generate import generate, RepoSpec, DEFAULT_SPEC
+from .run import run_benchmarks, compare, measure, Context
+from .cases import CASES
@@ -0,0 +1,366 @@
+import contextlib
+import io
+import os
+from gitcode import git
+from gitcode.exceptions import Error
+from gitcode.history import HistoryIndex
+
+# name -> (function(context) returning the call to time, whether it changes the repository)
+CASES = {}
+
+# Other names for methods that are benchmarked under their main name
+ALIASES = {'add': 'stage_files', 'change_branch': 'checkout', 'check_origin': 'get_remotes', 'ignore': 'gitignore'}
+
+def case(name, mutates=False):
+    def register(function):
+        CASES[name] = (function, mutates)
+        return function
+    return register
+
+def _quiet(function, *args, **kwargs):
+    '''Calls function with stdout hidden (some methods print git's output) and
+    expected gitcode errors, such as merge conflicts, ignored'''
+    def call():
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.suppress(Error):
+            return function(*args, **kwargs)
+    return call
+
+def _touch(repo, paths, text='benchmark edit\n'):
+    for path in paths:
+        with open(os.path.join(repo.path, path), 'a') as file:
+            file.write(text)
+
+
+# Reading history and refs
+
+@case('Repo.log')
+def _log(ctx):
+    return ctx.repo.log
+
+@case('Repo.iter_log')
+def _iter_log(ctx):
+    return lambda: list(ctx.repo.iter_log())
+
+@case('Repo.status')
+def _status(ctx):
+    return ctx.repo.status
+
+@case('Repo.worktree_status')
+def _worktree_status(ctx):
+    ctx.repo.worktree_status()
+    return ctx.repo.worktree_status
+
+@case('Repo.worktree_status (dirty)', mutates=True)
+def _worktree_status_dirty(ctx):
+    repo = ctx.fresh()
+    _touch(repo, ctx.files[:20])
+    return repo.worktree_status
+
+@case('Repo.branch')
+def _branch(ctx):
+    return ctx.repo.branch
+
+@case('Repo.branches')
+def _branches(ctx):
+    return lambda: ctx.repo.branches
+
+@case('Repo.current_branch')
+def _current_branch(ctx):
+    return lambda: ctx.repo.current_branch
+
+@case('Repo.get_remotes')
+def _get_remotes(ctx):
+    return ctx.repo.get_remotes
+
+@case('Repo.resolve')
+def _resolve(ctx):
+    return lambda: [ctx.repo.resolve(branch) for branch in ctx.branches]
+
+@case('Repo.commit_sha')
+def _commit_sha(ctx):
+    return lambda: ctx.repo.commit_sha('main~10')
+
+@case('Repo.tree_sha')
+def _tree_sha(ctx):
+    return lambda: ctx.repo.tree_sha('main')
+
+@case('Repo.is_ancestor')
+def _is_ancestor(ctx):
+    return lambda: ctx.repo.is_ancestor(ctx.root, 'main')
+
+@case('Repo.is_ancestor_many')
+def _is_ancestor_many(ctx):
+    pairs = [(a, b) for a in ctx.branches for b in ctx.branches]
+    return lambda: ctx.repo.is_ancestor_many(pairs)
+
+@case('Repo.merge_base')
+def _merge_base(ctx):
+    return lambda: ctx.repo.merge_base('main', ctx.branches[-1])
+
+@case('Repo.preview_merge')
+def _preview_merge(ctx):
+    return lambda: ctx.repo.preview_merge('main', ctx.branches[-1])
+
+@case('Repo.preview_merges')
+def _preview_merges(ctx):
+    pairs = [(a, b) for a in ctx.branches for b in ctx.branches if a != b]
+    return lambda: ctx.repo.preview_merges(pairs)
+
+@case('Repo.ahead_behind')
+def _ahead_behind(ctx):
+    return lambda: ctx.repo.ahead_behind(ctx.branches[-1], 'main')
+
+@case('Repo.ahead_behind_many')
+def _ahead_behind_many(ctx):
+    return lambda: ctx.repo.ahead_behind_many('main', ctx.branches)
+
+@case('Repo.diff')
+def _diff(ctx):
+    # A new Repo each time, so the diff cache starts empty
+    repo = ctx.open()
+    return lambda: list(repo.diff(ctx.root, 'main'))
+
+@case('Repo.diff (cached)')
+def _diff_cached(ctx):
+    list(ctx.repo.diff(ctx.root, 'main'))
+    return lambda: list(ctx.repo.diff(ctx.root, 'main'))
+
+@case('Repo.grep')
+def _grep(ctx):
+    return lambda: list(ctx.repo.grep('alpha beta', revs=['main'] + ctx.branches))
+
+@case('Repo.grep (cached)')
+def _grep_cached(ctx):
+    list(ctx.repo.grep('alpha beta', revs=['main'] + ctx.branches, cache=True))
+    return lambda: list(ctx.repo.grep('alpha beta', revs=['main'] + ctx.branches, cache=True))
+
+
+# Reading objects
+
+@case('Repo.read_object')
+def _read_object(ctx):
+    return lambda: [ctx.repo.read_object(sha) for sha in ctx.commits[:200]]
+
+@case('Repo.object_info')
+def _object_info(ctx):
+    return lambda: ctx.repo.object_info(ctx.commits)
+
+@case('Repo.object_store')
+def _object_store(ctx):
+    repo = ctx.open()
+    return lambda: repo.object_store().read(ctx.commits[0])
+
+@case('Repo.open_blob')
+def _open_blob(ctx):
+    buffer = bytearray(65536)
+
+    def read():
+        for path, sha in ctx.blobs[:100]:
+            with ctx.repo.open_blob('main', path) as blob:
+                while blob.readinto(buffer):
+                    pass
+    return read
+
+@case('Repo.write_blob', mutates=True)
+def _write_blob(ctx):
+    repo = ctx.fresh()
+    # Larger than one write chunk, so the data is streamed
+    content = os.urandom(ctx.spec.file_size * 64)
+    return lambda: repo.write_blob(io.BytesIO(content))
+
+@case('Repo.close')
+def _close(ctx):
+    repo = ctx.open()
+    repo.read_object(ctx.commits[0])
+    repo.object_info(ctx.commits[:1])
+    return repo.close
+
+
+# Changing the working tree, index and refs
+
+@case('Repo.commit', mutates=True)
+def _commit(ctx):
+    repo = ctx.fresh()
+    _touch(repo, ctx.files[:20])
+    return lambda: repo.commit(message='Benchmark commit')
+
+@case('Repo.stage_files', mutates=True)
+def _stage_files(ctx):
+    repo = ctx.fresh()
+    _touch(repo, ctx.files[:20])
+    return repo.stage_files
+
+@case('Repo.stage', mutates=True)
+def _stage(ctx):
+    repo = ctx.fresh()
+    _touch(repo, ctx.files[:20])
+    return lambda: repo.stage(ctx.files[:20])
+
+@case('Repo.unstage', mutates=True)
+def _unstage(ctx):
+    repo = ctx.fresh()
+    _touch(repo, ctx.files[:20])
+    repo.stage(ctx.files[:20])
+    return lambda: repo.unstage(ctx.files[:20])
+
+@case('Repo.stage_blobs', mutates=True)
+def _stage_blobs(ctx):
+    repo = ctx.fresh()
+    blobs = {f'copies/{path}': sha for path, sha in ctx.blobs[:200]}
+    return lambda: repo.stage_blobs(blobs)
+
+@case('Repo.remove_files', mutates=True)
+def _remove_files(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.remove_files(cached=True, pathspec=ctx.files[:20])
+
+@case('Repo.checkout', mutates=True)
+def _checkout(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.checkout(ctx.branches[-1])
+
+@case('Repo.delete_branch', mutates=True)
+def _delete_branch(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.delete_branch(ctx.branches[-1])
+
+@case('Repo.merge', mutates=True)
+def _merge(ctx):
+    repo = ctx.fresh()
+    return _quiet(repo.merge, ctx.branches[-1])
+
+@case('Repo.abort_merge', mutates=True)
+def _abort_merge(ctx):
+    repo = ctx.fresh()
+    _quiet(repo.merge, ctx.branches[-1], commit=False)()
+    return _quiet(repo.abort_merge)
+
+@case('Repo.continue_merge', mutates=True)
+def _continue_merge(ctx):
+    repo = ctx.fresh()
+    _quiet(repo.merge, ctx.branches[-1], commit=False)()
+    return _quiet(repo.continue_merge)
+
+@case('Repo.reset', mutates=True)
+def _reset(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.reset('hard', ctx.root)
+
+@case('Repo.gitignore', mutates=True)
+def _gitignore(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.gitignore(['*.log', 'build/'])
+
+@case('Repo.add_remote', mutates=True)
+def _add_remote(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.add_remote(ctx.remote, name='mirror')
+
+@case('Repo.set_remote', mutates=True)
+def _set_remote(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.set_remote(ctx.remote)
+
+@case('Repo.update_refs', mutates=True)
+def _update_refs(ctx):
+    repo = ctx.fresh()
+    updates = [(f'refs/heads/bench{i}', sha, None) for i, sha in enumerate(ctx.commits[:100])]
+    return lambda: repo.update_refs(updates)
+
+@case('Repo.commit_builder', mutates=True)
+def _commit_builder(ctx):
+    repo = ctx.fresh()
+
+    def build():
+        with repo.commit_builder('generated') as builder:
+            for i in range(20):
+                builder.add(f'generated/{i}.txt', f'{i}\n')
+                builder.commit(f'Generate {i}')
+    return build
+
+@case('Repo.worktree_pool', mutates=True)
+def _worktree_pool(ctx):
+    repo = ctx.fresh()
+
+    def lease():
+        # Leases each branch twice, so half the leases reuse a worktree
+        with repo.worktree_pool(size=2) as pool:
+            for branch in ctx.branches[:2] * 2:
+                with pool.lease(branch):
+                    pass
+    return lease
+
+
+# Talking to a remote (a local bare repository)
+
+@case('Repo.fetch', mutates=True)
+def _fetch(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.fetch('origin')
+
+@case('Repo.pull', mutates=True)
+def _pull(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.pull('origin', branch='main')
+
+@case('Repo.push', mutates=True)
+def _push(ctx):
+    repo = ctx.fresh()
+    return lambda: repo.push(remote='origin', branch=f'push{ctx.copies}')
+
+
+# Module functions
+
+@case('git.init', mutates=True)
+def _init(ctx):
+    return _quiet(git.init, ctx.scratch())
+
+@case('git.clone', mutates=True)
+def _clone(ctx):
+    path = ctx.scratch()
+    return lambda: git.clone(path, ctx.remote, directory='clone')
+
+@case('git.clone (blob:none)', mutates=True)
+def _clone_partial(ctx):
+    path = ctx.scratch()
+    return lambda: git.clone(path, ctx.remote, directory='clone', filter='blob:none')
+
+@case('git.clone (depth=1)', mutates=True)
+def _clone_shallow(ctx):
+    path = ctx.scratch()
+    return lambda: git.clone(path, ctx.remote, directory='clone', depth=1)
+
+@case('git.set_identity', mutates=True)
+def _set_identity(ctx):
+    repo = ctx.fresh()
+
+    def call():
+        # set_identity configures the repository in the current directory
+        cwd = os.getcwd()
+        os.chdir(repo.path)
+        try:
+            git.set_identity('Bench', 'bench@example.com')
+        finally:
+            os.chdir(cwd)
+    return call
+
+@case('git.help')
+def _help(ctx):
+    return _quiet(git.help)
+
+
+# History index
+
+@case('HistoryIndex.update', mutates=True)
+def _history_update(ctx):
+    repo = ctx.fresh()
+
+    def call():
+        with HistoryIndex(repo) as history:
+            history.update()
+    return call
+
+@case('HistoryIndex.query')
+def _history_query(ctx):
+    history = ctx.history()
+    return lambda: history.query(path='dir1', message='Change 1')
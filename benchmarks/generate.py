@@ -0,0 +1,92 @@
+from subprocess import DEVNULL
+from collections import namedtuple
+import os
+import random
+import subprocess
+
+RepoSpec = namedtuple('RepoSpec', ['commits', 'files', 'file_size', 'branches', 'binary', 'seed'])
+
+DEFAULT_SPEC = RepoSpec(commits=500, files=500, file_size=2048, branches=8, binary=0.05, seed=1)
+
+START_TIME = 1600000000
+IDENT = 'Bench <bench@example.com>'
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'theta', 'iota', 'kappa', 'lambda',
+         'return', 'import', 'class', 'value', 'index', 'buffer', 'render', 'commit', 'branch', 'tree')
+
+def _text(rng, size):
+    lines = []
+    length = 0
+    while length < size:
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        lines.append(line)
+        length += len(line) + 1
+    return ('\n'.join(lines) + '\n').encode('ascii')[:size]
+
+def _binary(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, 'little') if size else b''
+
+def _path(index):
+    # Spread files over a two-level directory tree, like a real project
+    return f'dir{index % 10}/sub{index % 7}/file{index}.txt'
+
+
+class _Stream():
+    '''Builds a `git fast-import` stream, so a whole history is written by one process'''
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.binary = set(i for i in range(spec.files) if self.rng.random() < spec.binary)
+        self.chunks = []
+        self.mark = 0
+
+    def _data(self, content):
+        self.chunks.append(b'data %d\n' % len(content))
+        self.chunks.append(content)
+        self.chunks.append(b'\n')
+
+    def _content(self, index):
+        if index in self.binary:
+            return _binary(self.rng, self.spec.file_size)
+        return _text(self.rng, self.spec.file_size)
+
+    def commit(self, branch, parent, number, indexes):
+        self.mark += 1
+        self.chunks.append(f'commit refs/heads/{branch}\nmark :{self.mark}\n'.encode('ascii'))
+        self.chunks.append(f'committer {IDENT} {START_TIME + number * 60} +0000\n'.encode('ascii'))
+        self._data(f'Change {number} on {branch}\n\nTouches {len(indexes)} files.\n'.encode('ascii'))
+        if parent != None:
+            self.chunks.append(f'from :{parent}\n'.encode('ascii'))
+        for index in indexes:
+            self.chunks.append(f'M 100644 inline {_path(index)}\n'.encode('ascii'))
+            self._data(self._content(index))
+        return self.mark
+
+    def build(self):
+        spec = self.spec
+        tips = {'main': self.commit('main', None, 0, range(spec.files))}
+        changed = max(1, spec.files // 50)
+        for number in range(1, spec.commits):
+            # New branches fork from main at evenly spaced points in history
+            if len(tips) < spec.branches and number % max(1, spec.commits // spec.branches) == 0:
+                tips[f'branch{len(tips)}'] = tips['main']
+            branch = self.rng.choice(sorted(tips))
+            indexes = self.rng.sample(range(spec.files), min(changed, spec.files))
+            tips[branch] = self.commit(branch, tips[branch], number, indexes)
+        self.chunks.append(b'done\n')
+        return b''.join(self.chunks)
+
+
+def generate(path, spec=DEFAULT_SPEC):
+    '''Creates a repository at path from spec. The same spec always produces the
+    same commits (and hashes), so results from different runs are comparable.
+    Returns the path, with main checked out.'''
+    if not os.path.exists(path):
+        os.makedirs(path)
+    subprocess.run(['git', 'init', '-q', '-b', 'main'], cwd=path, check=True)
+    for key, value in (('user.name', 'Bench'), ('user.email', 'bench@example.com')):
+        subprocess.run(['git', 'config', key, value], cwd=path, check=True)
+    subprocess.run(['git', 'fast-import', '--quiet', '--done'], cwd=path, input=_Stream(spec).build(),
+                   stdout=DEVNULL, check=True)
+    subprocess.run(['git', 'reset', '-q', '--hard', 'main'], cwd=path, check=True)
+    return path
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from gitcode.git import Repo
+from gitcode.history import HistoryIndex
+from gitcode.runner import Runner, runner as default_runner
+from .cases import CASES, ALIASES
+from .generate import generate, RepoSpec, DEFAULT_SPEC
+
+def _git(args, cwd):
+    return subprocess.run(['git'] + args, cwd=cwd, check=True, capture_output=True).stdout.decode('utf-8')
+
+
+class Context():
+    '''A generated repository (with a bare clone of it as origin) shared by the
+    benchmark cases. Cases that change a repository get their own copy.'''
+
+    def __init__(self, workdir, spec=DEFAULT_SPEC):
+        self.workdir = workdir
+        self.spec = spec
+        self.runner = Runner()
+        self.source = generate(os.path.join(workdir, 'source'), spec)
+        self.remote = os.path.join(workdir, 'remote.git')
+        _git(['clone', '-q', '--bare', self.source, self.remote], workdir)
+        _git(['remote', 'add', 'origin', self.remote], self.source)
+        _git(['fetch', '-q', 'origin'], self.source)
+        _git(['branch', '-q', '--set-upstream-to=origin/main'], self.source)
+        self.commits = _git(['rev-list', '--all'], self.source).split()
+        self.root = self.commits[-1]
+        self.files = _git(['ls-files'], self.source).splitlines()
+        # (path, blob sha) for every tracked file, from lines like '100644 <sha> 0\t<path>'
+        self.blobs = [(line.split('\t', 1)[1], line.split(' ')[1])
+                      for line in _git(['ls-files', '-s'], self.source).splitlines()]
+        # Every branch but main, which is checked out
+        self.branches = sorted(set(_git(['branch', '--format=%(refname:short)'], self.source).split()) - {'main'})
+        self.repo = Repo(self.source, runner=self.runner)
+        self.copies = 0
+        self.temporary = []
+        self._history = None
+
+    def _path(self, name):
+        self.copies += 1
+        path = os.path.join(self.workdir, f'{name}{self.copies}')
+        self.temporary.append(path)
+        return path
+
+    def open(self):
+        '''A new Repo object for the shared repository, with nothing cached'''
+        repo = Repo(self.source, runner=self.runner)
+        self.temporary.append(repo)
+        return repo
+
+    def fresh(self):
+        '''A throwaway copy of the shared repository'''
+        path = self._path('copy')
+        shutil.copytree(self.source, path, symlinks=True)
+        repo = Repo(path, runner=self.runner)
+        self.temporary.append(repo)
+        return repo
+
+    def scratch(self):
+        '''A path that doesn't exist yet'''
+        return self._path('scratch')
+
+    def history(self):
+        if self._history == None:
+            self._history = HistoryIndex(self.repo, path=os.path.join(self.workdir, 'history.sqlite'))
+            self._history.update()
+        return self._history
+
+    def spawned(self):
+        return self.runner.spawned + default_runner.spawned
+
+    def state(self):
+        '''The refs, HEAD and working tree status of the shared repository, to
+        check that cases not marked as mutating leave it alone'''
+        return (_git(['for-each-ref', '--format=%(refname) %(objectname)'], self.source)
+                + _git(['rev-parse', '--symbolic-full-name', 'HEAD', 'HEAD'], self.source)
+                + _git(['status', '--porcelain', '--untracked-files=all'], self.source))
+
+    def cleanup(self):
+        '''Removes everything made by fresh(), open() and scratch() since the last cleanup'''
+        for item in self.temporary:
+            if isinstance(item, Repo):
+                item.close()
+            else:
+                shutil.rmtree(item, ignore_errors=True)
+        self.temporary = []
+
+    def close(self):
+        self.cleanup()
+        self.repo.close()
+        if self._history != None:
+            self._history.close()
+
+
+def measure(ctx, name, repeat=5):
+    '''Times one case. Every run gets its own setup, which isn't timed. The
+    timed runs don't trace allocations, as tracemalloc slows Python code down;
+    one extra run records peak memory and the number of git processes started.
+    A case not registered as mutating must leave the shared repository as it was.'''
+    function, mutates = CASES[name]
+    before = None if mutates else ctx.state()
+    times = []
+    for _ in range(repeat):
+        call = function(ctx)
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+        ctx.cleanup()
+    call = function(ctx)
+    spawned = ctx.spawned()
+    tracemalloc.start()
+    try:
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    spawns = ctx.spawned() - spawned
+    ctx.cleanup()
+    if before != None and ctx.state() != before:
+        # Later cases would be measured against a different repository
+        raise RuntimeError(f'{name} changed the shared repository; register it with mutates=True '
+                           'and run it on ctx.fresh()')
+    # The fastest run is the least disturbed by the rest of the machine, so it's what gets compared
+    return {'seconds': min(times), 'median_seconds': statistics.median(times), 'spawns': spawns,
+            'peak_memory': peak}
+
+def uncovered():
+    '''Public Repo methods and module functions without a benchmark case'''
+    names = set(name.split(' ')[0] for name in CASES)
+    missing = []
+    for attr in dir(Repo):
+        if not attr.startswith('_') and attr not in ALIASES and f'Repo.{attr}' not in names:
+            if callable(getattr(Repo, attr)) or attr in ('branches', 'current_branch'):
+                missing.append(f'Repo.{attr}')
+    for attr in ('init', 'clone', 'set_identity', 'help'):
+        if f'git.{attr}' not in names:
+            missing.append(f'git.{attr}')
+    return missing
+
+def run_benchmarks(spec=DEFAULT_SPEC, repeat=5, only=None, workdir=None, report=None):
+    '''Runs every case (or those whose name contains only) against a repository
+    generated from spec. Returns results in the form saved as a baseline.'''
+    cleanup = workdir == None
+    if workdir == None:
+        workdir = tempfile.mkdtemp(prefix='gitcode-bench-')
+    ctx = Context(workdir, spec)
+    results = {}
+    try:
+        for name in CASES:
+            if only != None and only not in name:
+                continue
+            results[name] = measure(ctx, name, repeat)
+            if report != None:
+                report(name, results[name])
+    finally:
+        ctx.close()
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+    git_version = subprocess.run(['git', '--version'], capture_output=True).stdout.decode('utf-8').strip()
+    return {'spec': spec._asdict(), 'git': git_version, 'python': platform.python_version(), 'results': results}
+
+def compare(results, baseline, tolerance=0.25, noise=0.005):
+    '''Returns (name, metric, baseline value, new value) for every regression.
+    A time or peak memory regresses when it grows by more than tolerance (and,
+    for time, by more than noise seconds, so jitter on tiny calls is ignored);
+    spawning any more git processes than before is always a regression.'''
+    regressions = []
+    if results['spec'] != baseline['spec']:
+        raise ValueError('Results were measured on a different repository spec than the baseline')
+    for name, new in results['results'].items():
+        old = baseline['results'].get(name)
+        if old == None:
+            continue
+        if new['seconds'] > old['seconds'] * (1 + tolerance) and new['seconds'] - old['seconds'] > noise:
+            regressions.append((name, 'seconds', old['seconds'], new['seconds']))
+        if new['peak_memory'] > old['peak_memory'] * (1 + tolerance):
+            regressions.append((name, 'peak_memory', old['peak_memory'], new['peak_memory']))
+        if new['spawns'] > old['spawns']:
+            regressions.append((name, 'spawns', old['spawns'], new['spawns']))
+    return regressions
+
+def _print_result(name, result):
+    print(f"{name:<32} {result['seconds'] * 1000:>10.2f} ms {result['spawns']:>6} spawns "
+          f"{result['peak_memory'] / 1024:>10.1f} KiB", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark gitcode against a '
+                                     'generated repository')
+    parser.add_argument('--commits', type=int, default=DEFAULT_SPEC.commits)
+    parser.add_argument('--files', type=int, default=DEFAULT_SPEC.files)
+    parser.add_argument('--file-size', type=int, default=DEFAULT_SPEC.file_size, help='bytes per file')
+    parser.add_argument('--branches', type=int, default=DEFAULT_SPEC.branches)
+    parser.add_argument('--binary', type=float, default=DEFAULT_SPEC.binary, help='fraction of binary files')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SPEC.seed)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case')
+    parser.add_argument('--only', help='only run cases whose name contains this')
+    parser.add_argument('--workdir', help='where to generate repositories (default: a temporary directory)')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved earlier with --save')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, e.g. 0.25 for 25%%')
+    args = parser.parse_args(argv)
+
+    spec = RepoSpec(args.commits, args.files, args.file_size, args.branches, args.binary, args.seed)
+    baseline = None
+    if args.baseline != None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['spec'] != spec._asdict():
+            parser.error(f'{args.baseline} was measured with a different repository spec: {baseline["spec"]}')
+    if args.only == None:
+        for name in uncovered():
+            print(f'No benchmark for {name}', file=sys.stderr)
+    results = run_benchmarks(spec, repeat=args.repeat, only=args.only, workdir=args.workdir, report=_print_result)
+    if args.save != None:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if baseline != None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f'Regression in {name}: {metric} went from {old:g} to {new:g}')
+        if regressions:
+            return 1
+        print('No regressions against the baseline')
+    return 0
@@ -0,0 +1,594 @@
+from asyncio.subprocess import PIPE, DEVNULL
+import asyncio
+import functools
+from .exceptions import *
+from .common import FILE_MODE, _git_error
+from .git import Repo, LOG_FORMAT, LOG_FIELDS, READ_CHUNK, NEGOTIATION_ALGORITHMS, _log_date, _parse_commit, _authenticated_url, _store_credentials, _update_ref_input, _ref_update_error, _pathspec_input, _index_info, _stage_error, _parse_merge_tree
+from .progress import ProgressReader
+from .runner import subcommand
+
+MAX_PROCESSES = 16
+
+def _kill(proc):
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+class AsyncRepo():
+    def __init__(self, path, origin=None, descriptor=None, timeout=None, semaphore=None, max_processes=MAX_PROCESSES, workers=4, runner=None):
+        self.name = descriptor
+        self.path = path
+        self.origin = origin
+        self.commits = []
+        self.latest_commit = None
+        self._positions = {}
+        self.timeout = timeout
+        # Pass the same semaphore to many AsyncRepos to cap git processes across all of them
+        self.semaphore = semaphore if semaphore != None else asyncio.Semaphore(max_processes)
+        self._repo = Repo(path, origin=origin, descriptor=descriptor, workers=workers, runner=runner)
+        self.runner = self._repo.runner
+
+    def __str__(self):
+        description = f'{self.name}, with the local repository at {self.path} and origin at {self.origin}'
+        return description
+
+    @property
+    def refs(self):
+        return self._repo.refs
+
+    @property
+    def branches(self):
+        return self._repo.branches
+
+    @property
+    def current_branch(self):
+        return self._repo.current_branch
+
+    def resolve(self, ref):
+        return self._repo.resolve(ref)
+
+    @property
+    def ancestry(self):
+        return self._repo.ancestry
+
+    async def commit_sha(self, rev):
+        return await self._in_thread(self._repo.commit_sha, rev)
+
+    async def tree_sha(self, rev):
+        return await self._in_thread(self._repo.tree_sha, rev)
+
+    async def is_ancestor(self, ancestor, descendant):
+        return await self._in_thread(self._repo.is_ancestor, ancestor, descendant)
+
+    async def is_ancestor_many(self, pairs):
+        return await self._in_thread(self._repo.is_ancestor_many, list(pairs))
+
+    async def merge_base(self, *revs, all=False):
+        return await self._in_thread(functools.partial(self._repo.merge_base, *revs, all=all))
+
+    async def ahead_behind(self, rev, base):
+        return await self._in_thread(self._repo.ahead_behind, rev, base)
+
+    async def ahead_behind_many(self, base, revs):
+        return await self._in_thread(self._repo.ahead_behind_many, base, list(revs))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._in_thread(self._repo.close)
+
+    async def _in_thread(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args))
+
+    async def _git_in_thread(self, function, *args):
+        '''Runs a Repo method that starts git in a thread, holding a slot of the
+        semaphore meanwhile so it counts towards the process limit. Unlike _git(),
+        it can't be timed out, and cancelling only stops the wait.'''
+        async with self.semaphore:
+            return await self._in_thread(function, *args)
+
+    async def _git(self, *args, input=None, timeout=None):
+        '''Runs git with args, returning (returncode, stdout, stderr). The child
+        is killed if the call times out or the awaiting task is cancelled.'''
+        timeout = self.timeout if timeout == None else timeout
+        async with self.semaphore:
+            invocation = self.runner.start(args, cwd=self.path)
+            try:
+                proc = await asyncio.create_subprocess_exec(self.runner.git, *args,
+                                                            stdin=DEVNULL if input == None else PIPE, stdout=PIPE,
+                                                            stderr=PIPE, cwd=self.path, env=invocation.env)
+            except BaseException:
+                self.runner.finish(invocation, None)
+                raise
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(input), timeout)
+            except asyncio.TimeoutError:
+                _kill(proc)
+                await proc.wait()
+                raise CommandTimeoutError(subcommand(args), timeout)
+            except BaseException:
+                _kill(proc)
+                await proc.wait()
+                raise
+            else:
+                invocation.bytes_in = len(input) if input != None else 0
+                invocation.bytes_out = len(out) + len(err)
+            finally:
+                self.runner.finish(invocation, proc.returncode)
+        return proc.returncode, out, err
+
+    async def _git_progress(self, *args, progress=None, source=None, timeout=None):
+        '''Like _git(), but streams progress updates to progress as they arrive.
+        Returns (returncode, stderr).'''
+        if progress == None:
+            code, out, err = await self._git(*args, timeout=timeout)
+            return code, err.decode('utf-8')
+        timeout = self.timeout if timeout == None else timeout
+        args = list(args)
+        args.insert(args.index(subcommand(args)) + 1, '--progress')
+        reader = ProgressReader(progress, source)
+        async with self.semaphore:
+            invocation = self.runner.start(args, cwd=self.path)
+            try:
+                proc = await asyncio.create_subprocess_exec(self.runner.git, *args, stdin=DEVNULL, stdout=DEVNULL,
+                                                            stderr=PIPE, cwd=self.path, env=invocation.env)
+            except BaseException:
+                self.runner.finish(invocation, None)
+                raise
+
+            async def pump():
+                while True:
+                    chunk = await proc.stderr.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    invocation.bytes_out += len(chunk)
+                    reader.feed(chunk)
+                return await proc.wait()
+
+            try:
+                await asyncio.wait_for(pump(), timeout)
+            except asyncio.TimeoutError:
+                _kill(proc)
+                await proc.wait()
+                raise CommandTimeoutError(subcommand(args), timeout)
+            except BaseException:
+                _kill(proc)
+                await proc.wait()
+                raise
+            finally:
+                self.runner.finish(invocation, proc.returncode)
+        return proc.returncode, reader.close()
+
+    def object_store(self):
+        return self._repo.object_store()
+
+    async def read_object(self, sha):
+        return await self._in_thread(self._repo.read_object, sha)
+
+    async def object_info(self, shas):
+        return await self._in_thread(self._repo.object_info, list(shas))
+
+    async def open_blob(self, rev, path=None):
+        return await self._in_thread(self._repo.open_blob, rev, path)
+
+    async def write_blob(self, content):
+        return await self._git_in_thread(self._repo.write_blob, content)
+
+    async def set_remote(self, url, name='origin', timeout=None):
+        code, out, err = await self._git('remote', 'set-url', f'{name}', f'{url}', timeout=timeout)
+        if code != 0:
+            raise RemoteNotExistsError(name)
+        if name == 'origin':
+            self.origin = url
+        return True
+
+    async def get_remotes(self, timeout=None):
+        code, out, err = await self._git('remote', '-v', timeout=timeout)
+        return out.decode('utf-8')
+
+    check_origin = get_remotes
+
+    async def add_remote(self, url, name='origin', timeout=None):
+        code, out, err = await self._git('remote', 'add', f'{name}', f'{url}', timeout=timeout)
+        if code != 0:
+            raise RemoteAlreadyExistsError(name)
+        if name == 'origin':
+            self.origin = url
+        return True
+
+    async def branch(self, timeout=None):
+        code, out, err = await self._git('branch', timeout=timeout)
+        return out.decode('utf-8')
+
+    async def checkout(self, name, new=False, timeout=None):
+        exists = name in self.branches
+        if new == True and not exists:
+            code, out, err = await self._git('checkout', '-b', f'{name}', timeout=timeout)
+            if code != 0:
+                raise BranchAlreadyExistsError(name)
+        elif new == False and exists:
+            code, out, err = await self._git('checkout', f'{name}', timeout=timeout)
+            if code != 0:
+                raise BranchNotExistsError(name)
+        elif new == True and exists:
+            raise BranchAlreadyExistsError(name)
+        elif new == False and not exists:
+            raise BranchNotExistsError(name)
+        return True
+
+    change_branch = checkout
+
+    async def delete_branch(self, name, timeout=None):
+        if name in self.branches:
+            code, out, err = await self._git('branch', '-D', f'{name}', timeout=timeout)
+            if code != 0:
+                raise CannotDeleteBranchError(name)
+            return True
+        else:
+            raise CannotDeleteBranchError(name)
+
+    async def merge(self, branch, commit=True, timeout=None):
+        await self.commit(message=f'About to merge {branch}', timeout=timeout)
+        if commit == False:
+            code, out, err = await self._git('merge', '--no-commit', branch, timeout=timeout)
+        else:
+            code, out, err = await self._git('merge', branch, timeout=timeout)
+        print(out.decode('utf-8'))
+        print(err.decode('utf-8'))
+        if code != 0:
+            if 'CONFLICT' in out.decode('utf-8') or 'Merge conflict' in err.decode('utf-8'):
+                raise ConflictError
+            raise MergeError(branch)
+        return True
+
+    async def abort_merge(self, timeout=None):
+        code, out, err = await self._git('merge', '--abort', timeout=timeout)
+        print(out.decode('utf-8'))
+        print(err.decode('utf-8'))
+        if code != 0:
+            raise MergeError(branch='No merge to abort')
+        return True
+
+    async def continue_merge(self, timeout=None):
+        code, out, err = await self._git('merge', '--continue', timeout=timeout)
+        print(out.decode('utf-8'))
+        print(err.decode('utf-8'))
+        if code != 0:
+            if 'unmerged' in err.decode('utf-8') or 'Merge conflict' in err.decode('utf-8'):
+                raise ConflictError
+            raise MergeError(branch='No merge to continue')
+        return True
+
+    async def preview_merge(self, ours, theirs, allow_unrelated=False, timeout=None):
+        ours, theirs = await self.commit_sha(ours), await self.commit_sha(theirs)
+        return await self._preview_merge(ours, theirs, allow_unrelated, timeout)
+
+    async def _preview_merge(self, ours, theirs, allow_unrelated, timeout):
+        command = ['merge-tree', '--write-tree', '-z', '--messages']
+        if allow_unrelated == True:
+            command.append('--allow-unrelated-histories')
+        code, out, err = await self._git(*command, ours, theirs, timeout=timeout)
+        # 0 is a clean merge and 1 a merge with conflicts; anything else is an error
+        if code not in (0, 1):
+            raise MergeError(theirs, message=_git_error(err.decode('utf-8'), 'Cannot merge the commits'))
+        return _parse_merge_tree(ours, theirs, out, code == 0)
+
+    async def preview_merges(self, pairs, workers=8, allow_unrelated=False, timeout=None):
+        # Resolve everything first, so a bad revision fails before any merge runs
+        pairs = [(await self.commit_sha(ours), await self.commit_sha(theirs)) for ours, theirs in pairs]
+        limit = asyncio.Semaphore(workers)
+
+        async def preview(ours, theirs):
+            async with limit:
+                return await self._preview_merge(ours, theirs, allow_unrelated, timeout)
+
+        return list(await asyncio.gather(*[preview(ours, theirs) for ours, theirs in pairs]))
+
+    async def stage_files(self, timeout=None):
+        code, out, err = await self._git('add', '-A', timeout=timeout)
+        return code == 0
+
+    add = stage_files
+
+    async def stage(self, paths, literal=True, timeout=None):
+        command = ['add', '-A', '--pathspec-from-file=-', '--pathspec-file-nul']
+        if literal == True:
+            command.insert(0, '--literal-pathspecs')
+        data = _pathspec_input(paths)
+        if not data:
+            return True
+        code, out, err = await self._git(*command, input=data, timeout=timeout)
+        if code != 0:
+            raise _stage_error(err.decode('utf-8'), paths)
+        return True
+
+    async def stage_blobs(self, blobs, mode=FILE_MODE, timeout=None):
+        data = _index_info(blobs, mode)
+        if not data:
+            return True
+        code, out, err = await self._git('update-index', '-z', '--index-info', input=data, timeout=timeout)
+        if code != 0:
+            raise _stage_error(err.decode('utf-8'), blobs)
+        return True
+
+    async def unstage(self, paths, literal=True, timeout=None):
+        data = _pathspec_input(paths)
+        if not data:
+            return True
+        try:
+            self.resolve('HEAD')
+            command = ['reset', '-q', '--pathspec-from-file=-', '--pathspec-file-nul']
+        except UnknownRevisionError:
+            # Nothing to reset to before the first commit, so drop the paths from the index instead
+            command = ['rm', '-r', '-q', '--cached', '--ignore-unmatch', '--pathspec-from-file=-', '--pathspec-file-nul']
+        if literal == True:
+            command.insert(0, '--literal-pathspecs')
+        code, out, err = await self._git(*command, input=data, timeout=timeout)
+        if code != 0:
+            raise _stage_error(err.decode('utf-8'), paths)
+        return True
+
+    async def remove_files(self, cached=False, pathspec=None, recursive=False, timeout=None):
+        if pathspec != None and not isinstance(pathspec, str):
+            command = ['rm', '--pathspec-from-file=-', '--pathspec-file-nul']
+            if recursive == True:
+                command.insert(1, '-r')
+            if cached == True:
+                command.insert(1, '--cached')
+            code, out, err = await self._git(*command, input=_pathspec_input(pathspec), timeout=timeout)
+        else:
+            command = ['rm']
+            if recursive == True and pathspec != None:
+                command.append('-r')
+            if cached == True:
+                command.append('--cached')
+            if pathspec != None:
+                command.append(f'{pathspec}')
+            code, out, err = await self._git(*command, timeout=timeout)
+        if code != 0:
+            raise RemoveFailureError
+        return True
+
+    async def commit(self, add=True, message=None, timeout=None):
+        try:
+            command = ['commit']
+            if add == True:
+                command.append('-a')
+            if message != None:
+                command.extend(['-m', f'{message}'])
+            else:
+                command.append('--allow-empty-message')
+            code, out, err = await self._git(*command, timeout=timeout)
+            if code != 0:
+                print((out + err).decode('utf-8').strip())
+                return False
+            commit_hash = self.resolve('HEAD')
+            ct = {'name': message, 'hash': commit_hash}
+            self._positions[ct['hash']] = len(self.commits)
+            self.commits.append(ct)
+            self.latest_commit = ct
+            return True
+        except Exception as e:
+            print(e)
+            return False
+
+    def commit_builder(self, ref=None, parent=None):
+        return self._repo.commit_builder(ref=ref, parent=parent)
+
+    def worktree_pool(self, size=4, directory=None, clean=True):
+        return self._repo.worktree_pool(size=size, directory=directory, clean=clean)
+
+    async def update_refs(self, updates, message=None, timeout=None):
+        updates = list(updates)
+        command = ['update-ref', '--stdin']
+        if message != None:
+            command.extend(['-m', f'{message}'])
+        code, out, err = await self._git(*command, input=_update_ref_input(updates), timeout=timeout)
+        if code != 0:
+            raise _ref_update_error(err.decode('utf-8'), updates)
+        return True
+
+    async def log(self, limit=None, format=None, timeout=None):
+        command = ['log']
+        if limit != None:
+            if not isinstance(limit, int):
+                return None
+            command.extend(['-n', f'{limit}'])
+        if format != None:
+            command.append(f'--pretty=format:{format}')
+        code, out, err = await self._git(*command, timeout=timeout)
+        if code != 0:
+            raise NoCommitsError
+        return out.decode('utf-8')
+
+    async def iter_log(self, rev=None, paths=None, since=None, until=None, limit=None, after=None):
+        if limit != None and limit <= 0:
+            # git treats a negative --max-count as no limit at all
+            return
+        command = ['log', '-z', f'--pretty=tformat:{LOG_FORMAT}']
+        if limit != None and after == None:
+            # When resuming, the commits before 'after' don't count towards the limit
+            command.append(f'--max-count={limit}')
+        if since != None:
+            command.append(f'--since={_log_date(since)}')
+        if until != None:
+            command.append(f'--until={_log_date(until)}')
+        if rev == None:
+            pass
+        elif isinstance(rev, str):
+            command.append(rev)
+        else:
+            command.extend(rev)
+        command.append('--')
+        if paths != None:
+            command.extend([paths] if isinstance(paths, str) else paths)
+
+        async with self.semaphore:
+            invocation = self.runner.start(command, cwd=self.path)
+            try:
+                proc = await asyncio.create_subprocess_exec(self.runner.git, *command, stdin=DEVNULL, stdout=PIPE,
+                                                            stderr=PIPE, cwd=self.path, env=invocation.env)
+            except BaseException:
+                self.runner.finish(invocation, None)
+                raise
+            try:
+                skipping = after != None
+                remaining = limit if after != None else None
+                fields = []
+                pending = b''
+                while True:
+                    chunk = await proc.stdout.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    invocation.bytes_out += len(chunk)
+                    parts = (pending + chunk).split(b'\0')
+                    pending = parts.pop()
+                    for part in parts:
+                        fields.append(part)
+                        if len(fields) < LOG_FIELDS:
+                            continue
+                        if skipping:
+                            skipping = not fields[0].decode('ascii').startswith(after)
+                            fields = []
+                            continue
+                        commit = _parse_commit([field.decode('utf-8', 'replace') for field in fields])
+                        fields = []
+                        yield commit
+                        if remaining != None:
+                            remaining -= 1
+                            if remaining == 0:
+                                return
+                err = (await proc.stderr.read()).decode('utf-8')
+                if await proc.wait() != 0:
+                    if 'does not have any commits' in err:
+                        raise NoCommitsError
+                    raise UnknownRevisionError(rev, message='Cannot read the log of a revision that does not exist')
+                if skipping:
+                    raise UnknownRevisionError(after, message='The commit to continue after is not in the log')
+            finally:
+                if proc.returncode == None:
+                    _kill(proc)
+                    await proc.wait()
+                self.runner.finish(invocation, proc.returncode)
+
+    async def diff(self, a, b=None, renames=False):
+        return await self._git_in_thread(lambda: list(self._repo.diff(a, b, renames=renames)))
+
+    async def grep(self, pattern, revs=None, paths=None, threads=None, max_matches=None, ignore_case=False, fixed=False,
+                   cache=False):
+        return await self._git_in_thread(lambda: list(self._repo.grep(pattern, revs=revs, paths=paths, threads=threads,
+                                                                      max_matches=max_matches, ignore_case=ignore_case,
+                                                                      fixed=fixed, cache=cache)))
+
+    async def status(self, short=False, porcelain=False, untracked=False, timeout=None):
+        if short:
+            code, out, err = await self._git('status', '--short', timeout=timeout)
+        elif porcelain:
+            code, out, err = await self._git('status', '--porcelain', timeout=timeout)
+        elif untracked:
+            code, out, err = await self._git('status', '-u', timeout=timeout)
+        else:
+            code, out, err = await self._git('status', timeout=timeout)
+        if code != 0:
+            raise NotRepositoryError(self.path, message=_git_error(err.decode('utf-8'), 'Folder is not a git repository'))
+        return out.decode('utf-8')
+
+    async def worktree_status(self, untracked=True):
+        return await self._git_in_thread(functools.partial(self._repo.worktree_status, untracked=untracked))
+
+    async def gitignore(self, content=[]):
+        return await self._in_thread(self._repo.gitignore, content)
+
+    ignore = gitignore
+
+    async def reset(self, mode, commit, timeout=None):
+        code, out, err = await self._git('reset', f'--{mode}', f'{commit}', timeout=timeout)
+        if code != 0:
+            raise UnknownRevisionError(commit)
+        new_hash = self.resolve('HEAD')
+        position = self._positions.get(new_hash)
+        if position != None and position < len(self.commits) and self.commits[position]['hash'] == new_hash:
+            for ct in self.commits[position + 1:]:
+                self._positions.pop(ct['hash'], None)
+            self.commits = self.commits[:position + 1]
+            self.latest_commit = self.commits[position]
+        else:
+            # Reset to a commit that wasn't made through this object, so none of
+            # the recorded commits can be relied on to still be in the history
+            self.commits = []
+            self._positions = {}
+            self.latest_commit = {'name': None, 'hash': new_hash}
+        return True
+
+    async def push(self, username=None, password=None, remote='origin', branch='master', all=False, progress=None, timeout=None):
+        if username != None and password != None:
+            _store_credentials(self.path, remote, username, password)
+
+        if all == True:
+            code, err = await self._git_progress('push', '-u', remote, '--all', branch, progress=progress, source=remote, timeout=timeout)
+        else:
+            code, err = await self._git_progress('push', '-u', remote, f'HEAD:{branch}', progress=progress, source=remote, timeout=timeout)
+        if code != 0:
+            raise PushError(remote, branch)
+        return True
+
+    async def pull(self, remote, username=None, password=None, branch=None, progress=None, timeout=None):
+        command = remote
+        if username != None and password != None:
+            command = _authenticated_url(remote, username, password)
+        if branch != None:
+            code, err = await self._git_progress('pull', f'{command}', f'{branch}', progress=progress, source=remote, timeout=timeout)
+        else:
+            code, err = await self._git_progress('pull', f'{command}', 'master', progress=progress, source=remote, timeout=timeout)
+        if code != 0:
+            raise PullError
+        return True
+
+    async def fetch(self, remotes=None, jobs=None, negotiation=None, negotiation_tips=None, prune=False, progress=None, timeout=None):
+        options = []
+        if negotiation != None:
+            if negotiation not in NEGOTIATION_ALGORITHMS:
+                raise ValueError(f'negotiation must be one of {", ".join(NEGOTIATION_ALGORITHMS)}')
+            options.extend(['-c', f'fetch.negotiationAlgorithm={negotiation}'])
+        options.append('fetch')
+        if prune == True:
+            options.append('--prune')
+        if negotiation_tips != None:
+            for tip in [negotiation_tips] if isinstance(negotiation_tips, str) else negotiation_tips:
+                options.append(f'--negotiation-tip={tip}')
+        if isinstance(remotes, str):
+            code, err = await self._git_progress(*options, remotes, progress=progress, source=remotes, timeout=timeout)
+            if code != 0:
+                raise FetchError(remotes, message=_git_error(err, 'Fetching from remote failed'))
+            return True
+        if progress == None:
+            command = options + [f'--jobs={int(jobs)}'] if jobs != None else list(options)
+            command.extend(['--all'] if remotes == None else ['--multiple', *remotes])
+            code, err = await self._git_progress(*command, timeout=timeout)
+            if code != 0:
+                raise FetchError('all remotes' if remotes == None else ', '.join(remotes),
+                                 message=_git_error(err, 'Fetching from remote failed'))
+            return True
+        # One fetch per remote so that every remote's transfer progress is reported
+        if remotes == None:
+            code, out, err = await self._git('remote', timeout=timeout)
+            remotes = out.decode('utf-8').split()
+        limit = asyncio.Semaphore(jobs or 1)
+
+        async def fetch_one(remote):
+            async with limit:
+                code, err = await self._git_progress(*options, remote, progress=progress, source=remote, timeout=timeout)
+            return remote, code
+
+        results = await asyncio.gather(*[fetch_one(remote) for remote in remotes])
+        failed = [remote for remote, code in results if code != 0]
+        if failed:
+            raise FetchError(', '.join(failed))
+        return True
@@ -0,0 +1,188 @@
+from subprocess import PIPE, DEVNULL
+import datetime
+import hashlib
+import os
+from .exceptions import *
+from .common import FILE_MODE
+from .objects import parse_tree
+
+TREE_MODE = '40000'
+GITLINK_MODE = '160000'
+
+def _object_type(mode):
+    mode = mode.lstrip('0')
+    if mode == TREE_MODE:
+        return 'tree'
+    if mode == GITLINK_MODE:
+        return 'commit'
+    return 'blob'
+
+def _ident_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (int, float)):
+        return f'@{int(value)} +0000'
+    return f'{value}'
+
+def _split(path):
+    parts = [part for part in path.replace(os.sep, '/').split('/') if part]
+    if not parts or '.' in parts or '..' in parts or '.git' in parts:
+        raise ValueError(f'{path} is not a valid path inside a repository')
+    return parts
+
+
+class CommitBuilder():
+    '''Builds commits straight into the object database without a checkout.
+    Only trees along changed paths are rewritten; everything else is reused
+    from the parent commit's tree. Each commit moves the ref with a single
+    `update-ref --stdin` transaction that fails if someone else moved it first.'''
+
+    def __init__(self, repo, ref=None, parent=None):
+        self.repo = repo
+        self.runner = repo.runner
+        if ref == None:
+            ref = repo.refs.head_ref or 'HEAD'
+        elif ref != 'HEAD' and not ref.startswith('refs/'):
+            ref = f'refs/heads/{ref}'
+        self.ref = ref
+        try:
+            self.expected = repo.refs.resolve(ref)
+        except UnknownRevisionError:
+            self.expected = None
+        self.parent = parent if parent != None else self.expected
+        if self.parent != None:
+            self.parent = repo.commit_sha(self.parent)
+        self.tree = self._commit_tree(self.parent) if self.parent != None else None
+        self.changes = {}
+        self._mktree = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        proc, self._mktree = self._mktree, None
+        if proc == None:
+            return
+        proc.stdin.close()
+        proc.wait()
+        proc.stdout.close()
+        self.runner.finish(proc.invocation, proc.returncode)
+
+    def _commit_tree(self, sha):
+        header = self.repo.read_object(sha).data.split(b'\n', 1)[0]
+        return header.split()[1].decode('ascii')
+
+    def write_blob(self, content):
+        '''Writes content (bytes, str or a binary file object) as a blob and returns its sha'''
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            sha = hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+            # Skip the process entirely for content that is already stored
+            if self.repo.object_info([sha])[0] != None:
+                return sha
+        return self.repo.write_blob(content)
+
+    def add(self, path, content=None, sha=None, mode=FILE_MODE):
+        '''Puts a file at path in the next commit, from content or an existing blob sha'''
+        if sha == None:
+            sha = self.write_blob(content if content != None else b'')
+        path = tuple(_split(path))
+        # Re-insert so that changes are applied in the order they were made
+        self.changes.pop(path, None)
+        self.changes[path] = (mode, sha)
+        return sha
+
+    def remove(self, path):
+        '''Drops a file or whole directory at path from the next commit'''
+        path = tuple(_split(path))
+        self.changes.pop(path, None)
+        self.changes[path] = None
+
+    def _make_tree(self, entries):
+        if self._mktree == None:
+            self._mktree = self.runner.popen(['mktree', '-z', '--batch'], cwd=self.repo.path,
+                                             stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        request = b''.join(f'{mode} {_object_type(mode)} {sha}\t'.encode('ascii') + os.fsencode(name) + b'\0'
+                           for name, (mode, sha) in entries.items()) + b'\0'
+        self._mktree.stdin.write(request)
+        self._mktree.stdin.flush()
+        line = self._mktree.stdout.readline()
+        self._mktree.invocation.bytes_in += len(request)
+        self._mktree.invocation.bytes_out += len(line)
+        if not line:
+            self.close()
+            raise ObjectWriteError('tree')
+        return line.decode('ascii').strip()
+
+    def _build(self, tree, changes, root=False):
+        entries = {}
+        if tree != None:
+            for mode, name, sha in parse_tree(self.repo.read_object(tree).data):
+                entries[name] = (mode, sha)
+        for name, change in changes.items():
+            if isinstance(change, dict):
+                current = entries.get(name)
+                subtree = current[1] if current != None and _object_type(current[0]) == 'tree' else None
+                sha = self._build(subtree, change)
+                if sha == None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = (TREE_MODE, sha)
+            elif change == None:
+                entries.pop(name, None)
+            else:
+                entries[name] = change
+        if not entries and not root:
+            # git doesn't store empty directories
+            return None
+        return self._make_tree(entries)
+
+    def write_tree(self):
+        '''Writes the parent's tree with every pending change applied and returns its sha'''
+        nested = {}
+        for parts, change in self.changes.items():
+            node = nested
+            for part in parts[:-1]:
+                if not isinstance(node.get(part), dict):
+                    node[part] = {}
+                node = node[part]
+            node[parts[-1]] = change
+        return self._build(self.tree, nested, root=True)
+
+    def commit(self, message, author=None, committer=None, date=None, parents=None, update_ref=True):
+        '''Creates a commit from the pending changes and returns its sha. Further
+        commits from this builder build on top of it.'''
+        tree = self.write_tree()
+        if parents == None:
+            parents = [self.parent] if self.parent != None else []
+        command = ['commit-tree', tree]
+        for parent in parents:
+            command.extend(['-p', parent])
+        env = dict(os.environ)
+        for role, ident in (('AUTHOR', author), ('COMMITTER', committer)):
+            if ident != None:
+                env[f'GIT_{role}_NAME'], env[f'GIT_{role}_EMAIL'] = ident
+            if date != None:
+                env[f'GIT_{role}_DATE'] = _ident_date(date)
+        proc = self.runner.run(command, cwd=self.repo.path, input=f'{message}'.encode('utf-8'), env=env)
+        if proc.returncode != 0:
+            raise ObjectWriteError('commit', message=proc.stderr.decode('utf-8').strip() or 'Cannot write the object')
+        sha = proc.stdout.decode('ascii').strip()
+        self.parent = sha
+        self.tree = tree
+        self.changes = {}
+        if update_ref == True:
+            self.update_ref(message=f'commit: {message}'.split('\n', 1)[0])
+        return sha
+
+    def update_ref(self, message=None):
+        '''Moves the ref to the latest commit, as long as nobody else has moved it since'''
+        if self.parent == None or self.parent == self.expected:
+            return False
+        self.repo.update_refs([(self.ref, self.parent, self.expected)], message=message)
+        self.expected = self.parent
+        return True
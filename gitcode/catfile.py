@@ -0,0 +1,241 @@
+from subprocess import PIPE, DEVNULL
+from collections import namedtuple
+import io
+import queue
+import threading
+from .runner import runner as default_runner
+
+GitObject = namedtuple('GitObject', ['sha', 'type', 'size', 'data'])
+ObjectInfo = namedtuple('ObjectInfo', ['sha', 'type', 'size'])
+
+# Requests are written in chunks so that neither side of the pipe can fill
+# up while the other is blocked on a write
+BATCH_CHUNK = 256
+
+
+class CatFile():
+    '''A single long-lived `git cat-file --batch` or `--batch-check` process'''
+
+    def __init__(self, path, check=False, runner=None):
+        self.path = path
+        self.check = check
+        self.runner = runner if runner != None else default_runner
+        self.proc = None
+
+    def start(self):
+        mode = '--batch-check' if self.check else '--batch'
+        self.proc = self.runner.popen(['cat-file', mode], cwd=self.path, stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def close(self):
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=5)
+        except Exception:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        self.runner.finish(proc.invocation, proc.returncode)
+
+    def request(self, names):
+        '''Sends every name down the pipe and returns one result per name, in order.
+        Restarts the process and retries once if it died underneath us.'''
+        try:
+            return self._request(names)
+        except (BrokenPipeError, ConnectionResetError, EOFError, ValueError):
+            self.close()
+            return self._request(names)
+
+    def _request(self, names):
+        if not self.alive():
+            self.close()
+            self.start()
+        results = []
+        for i in range(0, len(names), BATCH_CHUNK):
+            chunk = names[i:i + BATCH_CHUNK]
+            request = b''.join(f'{name}\n'.encode('utf-8') for name in chunk)
+            self.proc.stdin.write(request)
+            self.proc.stdin.flush()
+            self.proc.invocation.bytes_in += len(request)
+            for name in chunk:
+                results.append(self._read_one(name))
+        return results
+
+    def open(self, name):
+        '''Requests one object but only reads its header, leaving the content in
+        the pipe for a BlobReader. Returns an ObjectInfo, or None if it's missing.'''
+        try:
+            return self._open(name)
+        except (BrokenPipeError, ConnectionResetError, EOFError, ValueError):
+            self.close()
+            return self._open(name)
+
+    def _open(self, name):
+        if not self.alive():
+            self.close()
+            self.start()
+        request = f'{name}\n'.encode('utf-8')
+        self.proc.stdin.write(request)
+        self.proc.stdin.flush()
+        self.proc.invocation.bytes_in += len(request)
+        return self._read_header(name)
+
+    def _read_header(self, name):
+        header = self.proc.stdout.readline()
+        if not header:
+            raise EOFError(name)
+        self.proc.invocation.bytes_out += len(header)
+        fields = header.decode('utf-8').split()
+        if fields[-1] in ('missing', 'ambiguous'):
+            return None
+        return ObjectInfo(fields[0], fields[1], int(fields[2]))
+
+    def _read_one(self, name):
+        info = self._read_header(name)
+        if info == None:
+            return None
+        sha, kind, size = info
+        if self.check:
+            return ObjectInfo(sha, kind, size)
+        data = self.proc.stdout.read(size)
+        self.proc.stdout.read(1)
+        self.proc.invocation.bytes_out += size + 1
+        if len(data) != size:
+            raise EOFError(name)
+        return GitObject(sha, kind, size, data)
+
+
+class CatFilePool():
+    '''A bounded pool of CatFile workers shared between threads'''
+
+    def __init__(self, path, size=4, check=False, runner=None):
+        self.path = path
+        self.size = size
+        self.check = check
+        self.runner = runner
+        self.idle = queue.LifoQueue()
+        self.workers = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self, block=True):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.closed:
+                raise ValueError('cat-file pool is closed')
+            if self.workers < self.size:
+                self.workers += 1
+                return CatFile(self.path, check=self.check, runner=self.runner)
+        if not block:
+            return None
+        return self.idle.get()
+
+    def release(self, worker):
+        if self.closed:
+            worker.close()
+        else:
+            self.idle.put(worker)
+
+    def request(self, names):
+        worker = self.acquire()
+        try:
+            results = worker.request(names)
+        except BaseException:
+            # A worker interrupted mid-response is out of sync with its pipe
+            worker.close()
+            self.release(worker)
+            raise
+        self.release(worker)
+        return results
+
+    def open(self, name):
+        '''Returns a BlobReader streaming the content of name, or None if it doesn't
+        exist. Each open reader holds a worker; when every worker is busy, a
+        short-lived extra one is started rather than waiting, so a caller holding
+        several readers at once can't deadlock itself.'''
+        worker = self.acquire(block=False)
+        extra = worker == None
+        if extra:
+            worker = CatFile(self.path, check=self.check, runner=self.runner)
+        try:
+            info = worker.open(name)
+        except BaseException:
+            worker.close()
+            if not extra:
+                self.release(worker)
+            raise
+        if info == None:
+            if extra:
+                worker.close()
+            else:
+                self.release(worker)
+            return None
+        return BlobReader(self if not extra else None, worker, info)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.close()
+
+
+class BlobReader(io.RawIOBase):
+    '''A read-only stream over one object's content, read straight from the
+    pipe of a `cat-file --batch` worker. Nothing is read ahead of what the
+    caller asks for, so memory use doesn't grow with the size of the object,
+    and readinto() fills the caller's buffer directly. The worker goes back to
+    its pool when the stream is closed.'''
+
+    def __init__(self, pool, worker, info):
+        super().__init__()
+        self.pool = pool
+        self.worker = worker
+        self.sha, self.type, self.size = info
+        self.remaining = info.size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.worker == None:
+            raise ValueError('I/O operation on closed blob')
+        view = memoryview(buffer).cast('B')
+        if self.remaining == 0 or len(view) == 0:
+            return 0
+        count = self.worker.proc.stdout.readinto1(view[:min(len(view), self.remaining)])
+        if count == 0:
+            raise EOFError(self.sha)
+        self.remaining -= count
+        self.worker.proc.invocation.bytes_out += count
+        return count
+
+    def close(self):
+        worker, self.worker = self.worker, None
+        if worker != None:
+            if self.remaining == 0:
+                # Consume the newline after the content so the next request lines up
+                worker.proc.stdout.read(1)
+                worker.proc.invocation.bytes_out += 1
+            else:
+                # Restarting the worker is cheaper than reading the rest of a big object
+                worker.close()
+            if self.pool != None:
+                self.pool.release(worker)
+            else:
+                worker.close()
+        super().close()
@@ -0,0 +1,10 @@
+ZERO_SHA = '0' * 40
+FILE_MODE = '100644'
+
+def _git_error(text, default):
+    '''Picks git's own explanation (the first "fatal:" or "error:" line) out of its stderr'''
+    for line in text.splitlines():
+        for prefix in ('fatal: ', 'error: '):
+            if line.startswith(prefix):
+                return line[len(prefix):].strip()
+    return default
@@ -0,0 +1,104 @@
+from collections import namedtuple, OrderedDict
+import threading
+
+DiffEntry = namedtuple('DiffEntry', ['path', 'old_path', 'status', 'old_mode', 'new_mode', 'old_sha', 'new_sha',
+                                     'similarity', 'added', 'deleted'])
+
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+
+class DiffParser():
+    '''Turns the NUL-separated fields of `diff-tree -r -z --raw --numstat` into
+    DiffEntry tuples. git prints every raw record first and then one numstat
+    record per raw record in the same order, so raw records are held until
+    their line counts arrive.'''
+
+    def __init__(self):
+        self.raw = []
+        self.position = 0
+        self.expect = 'record'
+        self.current = None
+
+    def feed(self, field):
+        '''Takes one field, returning a finished DiffEntry or None'''
+        field = field.decode('utf-8', 'surrogateescape')
+        if self.expect == 'record':
+            if field.startswith(':'):
+                old_mode, new_mode, old_sha, new_sha, status = field[1:].split(' ')
+                self.current = [old_mode, new_mode, old_sha, new_sha, status, None]
+                self.expect = 'path'
+                return None
+            added, deleted, path = field.split('\t', 2)
+            self.current = [None if added == '-' else int(added), None if deleted == '-' else int(deleted)]
+            if path == '':
+                # A rename or copy: the old and new paths follow as their own fields
+                self.expect = 'numstat_old'
+                return None
+            return self._finish()
+        if self.expect == 'path':
+            self.current[5] = field
+            if self.current[4][0] in 'RC':
+                self.expect = 'new_path'
+                return None
+            self.current.append(field)
+            return self._store()
+        if self.expect == 'new_path':
+            self.current.append(field)
+            return self._store()
+        if self.expect == 'numstat_old':
+            self.expect = 'numstat_new'
+            return None
+        return self._finish()
+
+    def _store(self):
+        self.raw.append(self.current)
+        self.expect = 'record'
+        return None
+
+    def _finish(self):
+        added, deleted = self.current
+        old_mode, new_mode, old_sha, new_sha, status, old_path, path = self.raw[self.position]
+        self.raw[self.position] = None
+        self.position += 1
+        self.expect = 'record'
+        similarity = int(status[1:]) if len(status) > 1 else None
+        if status[0] not in 'RC':
+            old_path = path
+        return DiffEntry(path, old_path, status[0], old_mode, new_mode, old_sha, new_sha, similarity, added, deleted)
+
+
+class DiffCache():
+    '''An LRU of finished diffs keyed by (tree_a, tree_b, renames). Trees are
+    immutable, so entries never go stale; the cache is bounded by the total
+    number of DiffEntry records it holds.'''
+
+    def __init__(self, limit=100000):
+        self.limit = limit
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, entries):
+        entries = tuple(entries)
+        if len(entries) > self.limit:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = entries
+            self.size += len(entries)
+            while self.size > self.limit:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.size = 0
@@ -1,6 +1,16 @@
+def _rebuild(cls, state):
+    error = cls.__new__(cls)
+    Exception.__init__(error, state.get('message'))
+    error.__dict__.update(state)
+    return error
+
 class Error(Exception):
     '''Base class for other exceptions'''
-    pass
+
+    def __reduce__(self):
+        # Subclasses take different constructor arguments, so pickle (e.g. across
+        # process pools) by restoring attributes rather than calling __init__
+        return (_rebuild, (type(self), dict(self.__dict__)))
 
 class RemoteNotExistsError(Error):
     '''Raised when trying to change a remote that doesn't exist'''
@@ -140,4 +150,93 @@ class ConflictError(Error):
         super().__init__(self.message)
     
     def __str__(self):
-        return f'{self.message}'
\ No newline at end of file
+        return f'{self.message}'
+
+class ObjectNotFoundError(Error):
+    '''Raised when an object cannot be found in the object database'''
+
+    def __init__(self, sha, message="Object does not exist in the repository"):
+        self.sha = sha
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'{self.sha} -> {self.message}'
+
+class CommandTimeoutError(Error):
+    '''Raised when a git command takes longer than its timeout'''
+
+    def __init__(self, command, timeout, message="Git command timed out and was stopped"):
+        self.command = command
+        self.timeout = timeout
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'git {self.command} after {self.timeout}s -> {self.message}'
+
+class StageError(Error):
+    '''Raised when staging or unstaging files fails'''
+
+    def __init__(self, path, message="Cannot stage or unstage a path that doesn't match any files"):
+        self.path = path
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'{self.path} -> {self.message}'
+
+class ObjectWriteError(Error):
+    '''Raised when git fails to write a blob, tree or commit'''
+
+    def __init__(self, type, message="Cannot write the object"):
+        self.type = type
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'{self.type} -> {self.message}'
+
+class RefUpdateError(Error):
+    '''Raised when a ref can't be moved, usually because it changed in the meantime'''
+
+    def __init__(self, ref, message="Cannot update a ref that was changed by someone else"):
+        self.ref = ref
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'{self.ref} -> {self.message}'
+
+class FetchError(Error):
+    '''Raised when fetching from a remote fails'''
+
+    def __init__(self, remote, message="Fetching from remote failed"):
+        self.remote = remote
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'{self.remote} -> {self.message}'
+
+class WorktreeError(Error):
+    '''Raised when a worktree can't be leased from a WorktreePool'''
+
+    def __init__(self, rev, message="Cannot add or reset a worktree for the revision"):
+        self.rev = rev
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'{self.rev} -> {self.message}'
+
+class GrepError(Error):
+    '''Raised when git can't run a search, usually because the pattern is invalid'''
+
+    def __init__(self, pattern, message="Cannot search for the pattern"):
+        self.pattern = pattern
+        self.message = message
+        super().__init__(self.message)
+    
+    def __str__(self):
+        return f'{self.pattern} -> {self.message}'
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import namedtuple
+from .git import Repo
+
+FleetResult = namedtuple('FleetResult', ['path', 'value', 'error'])
+
+def _apply(path, operation, args, kwargs):
+    '''Runs one operation against the repository at path. Lives at module level
+    so that it can be sent to a process pool.'''
+    repo = Repo(path)
+    try:
+        if callable(operation):
+            return operation(repo, *args, **kwargs)
+        return getattr(repo, operation)(*args, **kwargs)
+    finally:
+        repo.close()
+
+
+class RepoFleet():
+    def __init__(self, paths, workers=16, processes=False):
+        self.paths = list(paths)
+        self.workers = workers
+        self.processes = processes
+
+    def __len__(self):
+        return len(self.paths)
+
+    def run(self, operation, *args, progress=None, fail_fast=False, **kwargs):
+        '''Runs operation (a Repo method name, or a callable taking a Repo) on every
+        repository and yields a FleetResult for each one as it finishes'''
+        executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        total = len(self.paths)
+        with executor(max_workers=self.workers) as pool:
+            futures = {pool.submit(_apply, path, operation, args, kwargs): path for path in self.paths}
+            try:
+                done = 0
+                for future in as_completed(futures):
+                    try:
+                        result = FleetResult(futures[future], future.result(), None)
+                    except Exception as e:
+                        result = FleetResult(futures[future], None, e)
+                    done += 1
+                    if progress != None:
+                        progress(done, total, result)
+                    if fail_fast and result.error != None:
+                        raise result.error
+                    yield result
+            finally:
+                # Stops anything not yet started when we fail fast or the caller stops early
+                for future in futures:
+                    future.cancel()
+
+    def collect(self, operation, *args, progress=None, fail_fast=False, **kwargs):
+        '''Like run(), but waits for every repository and returns a dict of path -> FleetResult'''
+        results = self.run(operation, *args, progress=progress, fail_fast=fail_fast, **kwargs)
+        return {result.path: result for result in results}
+
+    def status(self, *args, **kwargs):
+        return self.run('status', *args, **kwargs)
+
+    def log(self, *args, **kwargs):
+        return self.run('log', *args, **kwargs)
+
+    def pull(self, *args, **kwargs):
+        return self.run('pull', *args, **kwargs)
@@ -1,27 +1,358 @@
-from subprocess import run, PIPE
+from subprocess import PIPE, DEVNULL
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import datetime
 import platform
 import os
+import pathlib
 import re
 from .exceptions import *
+from .common import ZERO_SHA, FILE_MODE, _git_error
+from .catfile import CatFilePool
+from .objects import ObjectStore
+from .gitdir import find_git_dir, find_common_dir
+from .refs import RefIndex
+from .graph import AncestryIndex, parse_commit
+from .diff import DiffParser, DiffCache, EMPTY_TREE
+from .grep import GrepMatch, GrepParser, GrepCache
+from .builder import CommitBuilder
+from .index import StatusScanner, StatusResult, UnsupportedIndex
+from .worktree import WorktreePool
+from .runner import runner as default_runner, subcommand
+from .progress import ProgressReader
+
+Commit = namedtuple('Commit', ['hash', 'parents', 'author_name', 'author_email', 'author_time',
+                               'committer_name', 'committer_email', 'commit_time', 'subject'])
+
+MergePreview = namedtuple('MergePreview', ['ours', 'theirs', 'tree', 'clean', 'conflicts', 'messages'])
+MergeConflict = namedtuple('MergeConflict', ['path', 'base', 'ours', 'theirs'])
+MergeMessage = namedtuple('MergeMessage', ['paths', 'type', 'message'])
+
+CloneMode = namedtuple('CloneMode', ['filter', 'depth', 'shallow_since', 'reference', 'dissociate', 'sparse'])
+
+LOG_FORMAT = '%H%x00%P%x00%an%x00%ae%x00%at%x00%cn%x00%ce%x00%ct%x00%s'
+LOG_FIELDS = 9
+READ_CHUNK = 65536
+WRITE_CHUNK = 65536
+HEX_SHA = re.compile('[0-9a-fA-F]{40}')
+NEGOTIATION_ALGORITHMS = ('consecutive', 'skipping', 'noop')
+
+def _log_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return f'{value}'
+
+def _authenticated_url(remote, username, password):
+    rest = remote.replace(re.search('.*.com', remote).group(), '')
+    site = re.search('/.*.com', remote).group()
+    site = site.replace('//', '')
+    return remote[:8] + username + ':' + password + '@' + site + rest
+
+def _store_credentials(path, remote, username, password):
+    site = re.search('/.*.com', remote).group()
+    site = site.replace('//', '')
+
+    command = remote[:8] + username + ':' + password + '@' + site
+    if platform.system == 'Windows':
+        file = open(f'{path}\.git-credentials', 'a')
+    else:
+        file = open(f'{path}/.git-credentials', 'a')
+    
+    file.write(f'{command}')
+    file.close()
+
+    with open('.gitignore', 'a') as f:
+        f.write('.git-credentials')
+
+def _pathspec_input(paths):
+    '''NUL-separates paths for --pathspec-from-file=- --pathspec-file-nul, so
+    any number of paths (and any characters in them) can be passed on stdin'''
+    if isinstance(paths, (str, bytes, os.PathLike)):
+        paths = [paths]
+    return b'\0'.join(os.fsencode(path) for path in paths)
+
+def _index_info(blobs, mode):
+    '''Builds `update-index -z --index-info` input from a {path: sha} mapping
+    or (path, sha) / (path, sha, mode) tuples. A sha of None removes the path.'''
+    if isinstance(blobs, dict):
+        blobs = blobs.items()
+    lines = []
+    for blob in blobs:
+        path, sha = blob[0], blob[1]
+        entry_mode = blob[2] if len(blob) > 2 else mode
+        if sha == None:
+            lines.append(b'0 ' + ZERO_SHA.encode('ascii') + b'\t' + os.fsencode(path))
+        else:
+            lines.append(f'{entry_mode} {sha}\t'.encode('ascii') + os.fsencode(path))
+    return b'\0'.join(lines) + b'\0' if lines else b''
+
+def _stage_error(err, paths):
+    match = re.search("pathspec '(.*)' did not match", err)
+    if match != None:
+        return StageError(match.group(1))
+    if 'ignored by one of your .gitignore' in err:
+        return StageError(paths, message='Cannot stage a path that is ignored')
+    return StageError(paths, message=err.strip() or 'Staging failed')
+
+def _update_ref_input(updates):
+    '''Builds `update-ref --stdin` input from (ref, new) or (ref, new, old) tuples'''
+    lines = []
+    for update in updates:
+        ref, new = update[0], update[1]
+        if len(update) > 2:
+            # An old value of None means the ref must not exist yet
+            old = update[2] if update[2] != None else ZERO_SHA
+        else:
+            old = ''
+        if new == None:
+            lines.append(f'delete {ref} {old}'.rstrip())
+        else:
+            lines.append(f'update {ref} {new} {old}'.rstrip())
+    return ''.join(f'{line}\n' for line in lines).encode('utf-8')
+
+def _ref_update_error(err, updates):
+    match = re.search("cannot lock ref '([^']*)'", err)
+    return RefUpdateError(match.group(1) if match != None else ', '.join(update[0] for update in updates))
+
+def _parse_porcelain(out):
+    '''Sorts the records of `git status --porcelain -z` into a StatusResult of
+    worktree changes, the same as a native scan would find'''
+    modified, deleted, untracked = set(), set(), set()
+    records = out.decode('utf-8', 'surrogateescape').split('\0')
+    i = 0
+    while i < len(records):
+        record = records[i]
+        i += 1
+        if len(record) < 4:
+            continue
+        code, path = record[:2], record[3:]
+        if code[0] in 'RC':
+            # The original path follows as its own record
+            i += 1
+        if code == '??':
+            untracked.add(path)
+        elif code in ('DD', 'AU', 'UD', 'UA', 'DU', 'AA', 'UU') or code[1] in 'MT':
+            modified.add(path)
+        elif code[1] == 'D':
+            deleted.add(path)
+        elif code[1] == 'A':
+            # Added with intent to add
+            modified.add(path)
+    return StatusResult(frozenset(modified), frozenset(deleted), frozenset(untracked))
+
+def _parse_merge_tree(ours, theirs, out, clean):
+    '''Reads `git merge-tree --write-tree -z` output: the tree, then one record per
+    conflicted stage, an empty field, and the messages, each of which is a path
+    count, that many paths, a type and the message itself'''
+    fields = out.decode('utf-8', 'surrogateescape').split('\0')
+    tree = fields[0]
+    stages = {}
+    i = 1
+    while i < len(fields) and fields[i] != '':
+        info, path = fields[i].split('\t', 1)
+        mode, sha, stage = info.split(' ')
+        stages.setdefault(path, [None, None, None])[int(stage) - 1] = (mode, sha)
+        i += 1
+    conflicts = [MergeConflict(path, *versions) for path, versions in stages.items()]
+    messages = []
+    i += 1
+    while i < len(fields) and fields[i] != '':
+        count = int(fields[i])
+        paths = tuple(fields[i + 1:i + 1 + count])
+        i += 1 + count
+        messages.append(MergeMessage(paths, fields[i], fields[i + 1].rstrip('\n')))
+        i += 2
+    return MergePreview(ours, theirs, tree, clean, conflicts, messages)
+
+def _parse_commit(fields):
+    return Commit(fields[0], tuple(fields[1].split()), fields[2], fields[3], int(fields[4]),
+                  fields[5], fields[6], int(fields[7]), fields[8])
 
 class Repo():
-    def __init__(self, path, origin=None, descriptor=None):
+    def __init__(self, path, origin=None, descriptor=None, workers=4, native=True, runner=None):
         self.name = descriptor
         self.path = path
         self.origin = origin
-        self.branches = ['master']
         self.commits = []
-        self.current_branch = 'master'
         self.latest_commit = None
+        self._positions = {}
+        self.workers = workers
+        self.runner = runner if runner != None else default_runner
+        self._objects = CatFilePool(path, size=workers, runner=self.runner)
+        self._object_info = CatFilePool(path, size=workers, check=True, runner=self.runner)
+        self.native = native
+        self._store = None
+        self._refs = None
+        self._ancestry = None
+        self._diffs = DiffCache()
+        self._greps = GrepCache()
+        self._scanner = None
+        self.clone_mode = None
 
     def __str__(self):
         description = f'{self.name}, with the local repository at {self.path} and origin at {self.origin}'
         return description
+
+    @property
+    def refs(self):
+        if self._refs == None:
+            self._refs = RefIndex(find_git_dir(self.path))
+        return self._refs
+
+    @property
+    def branches(self):
+        return self.refs.branches
+
+    @property
+    def current_branch(self):
+        return self.refs.current_branch
+
+    def resolve(self, ref):
+        return self.refs.resolve(ref)
+
+    @property
+    def ancestry(self):
+        if self._ancestry == None:
+            objects = os.path.join(find_common_dir(find_git_dir(self.path)), 'objects')
+            self._ancestry = AncestryIndex(objects, lambda sha: self.read_object(sha).data)
+        return self._ancestry
+
+    def commit_sha(self, rev):
+        try:
+            sha = self.resolve(rev)
+        except UnknownRevisionError:
+            proc = self._git(['rev-parse', '--verify', '--quiet', f'{rev}^{{commit}}'])
+            if proc.returncode != 0:
+                raise UnknownRevisionError(rev, message='Revision does not exist or is not a commit')
+            return proc.stdout.decode('utf-8').strip()
+        obj = self.read_object(sha)
+        while obj.type == 'tag':
+            sha = obj.data.split(b'\n', 1)[0].split()[1].decode('ascii')
+            obj = self.read_object(sha)
+        if obj.type != 'commit':
+            raise UnknownRevisionError(rev, message='Revision does not exist or is not a commit')
+        return sha
+
+    def is_ancestor(self, ancestor, descendant):
+        return self.ancestry.is_ancestor(self.commit_sha(ancestor), self.commit_sha(descendant))
+
+    def is_ancestor_many(self, pairs):
+        shas = [(self.commit_sha(ancestor), self.commit_sha(descendant)) for ancestor, descendant in pairs]
+        return self.ancestry.is_ancestor_many(shas)
+
+    def merge_base(self, *revs, all=False):
+        if len(revs) < 2:
+            raise ValueError('merge_base needs at least two revisions')
+        shas = [self.commit_sha(rev) for rev in revs]
+        bases = self.ancestry.merge_bases(shas[0], shas[1:])
+        if all:
+            return bases
+        return bases[0] if bases else None
+
+    def ahead_behind(self, rev, base):
+        return self.ancestry.ahead_behind_many(self.commit_sha(base), [self.commit_sha(rev)])[0]
+
+    def ahead_behind_many(self, base, revs):
+        return self.ancestry.ahead_behind_many(self.commit_sha(base), [self.commit_sha(rev) for rev in revs])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._objects.close()
+        self._object_info.close()
+        if self._store != None:
+            self._store.close()
+            self._store = None
+        if self._ancestry != None and self._ancestry.graph != None:
+            self._ancestry.graph.close()
+        self._ancestry = None
+
+    def object_store(self):
+        if self._store == None:
+            objects = os.path.join(find_common_dir(find_git_dir(self.path)), 'objects')
+            self._store = ObjectStore(objects)
+        return self._store
+
+    def read_object(self, sha):
+        if self.native and HEX_SHA.fullmatch(sha):
+            try:
+                return self.object_store().read(sha)
+            except (ObjectNotFoundError, NotRepositoryError):
+                # Fall back to git for anything the native reader can't serve
+                pass
+            except ValueError:
+                # A pack index in a format the native reader doesn't know, so leave every read to git
+                self.native = False
+        obj = self._objects.request([sha])[0]
+        if obj == None:
+            raise ObjectNotFoundError(sha)
+        return obj
+
+    def object_info(self, shas):
+        return self._object_info.request(list(shas))
+
+    def open_blob(self, rev, path=None):
+        name = f'{rev}:{path}' if path != None else f'{rev}'
+        if '\n' in name:
+            raise ObjectNotFoundError(name)
+        blob = self._objects.open(name)
+        if blob == None:
+            raise ObjectNotFoundError(name)
+        if blob.type != 'blob':
+            blob.close()
+            raise ObjectNotFoundError(name, message=f'Object is a {blob.type}, not a blob')
+        return blob
+
+    def write_blob(self, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        proc = self.runner.popen(['hash-object', '-w', '--stdin'], cwd=self.path, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        try:
+            if isinstance(content, (bytes, bytearray, memoryview)):
+                proc.stdin.write(content)
+                proc.invocation.bytes_in += len(content)
+            else:
+                # One buffer is reused for every chunk, so memory use doesn't depend on the file's size
+                buffer = bytearray(WRITE_CHUNK)
+                view = memoryview(buffer)
+                readinto = getattr(content, 'readinto', None)
+                while True:
+                    if readinto != None:
+                        count = readinto(buffer)
+                        chunk = view[:count] if count else None
+                    else:
+                        chunk = content.read(WRITE_CHUNK)
+                    if not chunk:
+                        break
+                    proc.stdin.write(chunk)
+                    proc.invocation.bytes_in += len(chunk)
+            proc.stdin.close()
+            out = proc.stdout.read()
+            err = proc.stderr.read()
+            proc.invocation.bytes_out += len(out) + len(err)
+            proc.wait()
+        finally:
+            if proc.returncode == None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+            self.runner.finish(proc.invocation, proc.returncode)
+        if proc.returncode != 0:
+            raise ObjectWriteError('blob', message=_git_error(err.decode('utf-8'), 'Cannot write the object'))
+        return out.decode('ascii').strip()
+
+    def _git(self, args, input=None, env=None, timeout=None):
+        return self.runner.run(args, cwd=self.path, input=input, env=env, timeout=timeout)
     
     def set_remote(self, url, name='origin'):
-        proc = run(['git', 'remote', 'set-url', f'{name}', f'{url}'], capture_output=True, cwd=self.path)
+        proc = self._git(['remote', 'set-url', f'{name}', f'{url}'])
         out, err = proc.stdout, proc.stderr
-        if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        if proc.returncode != 0:
             raise RemoteNotExistsError(name)
         if name == 'origin':
             self.origin = url
@@ -29,7 +360,7 @@ class Repo():
     
     def get_remotes(self):
         try:
-            proc = run(['git', 'remote', '-v'], capture_output=True, cwd=self.path)
+            proc = self._git(['remote', '-v'])
             out, err = proc.stdout, proc.stderr
             remotes = out.decode('utf-8')
             return remotes
@@ -39,9 +370,9 @@ class Repo():
     check_origin = get_remotes
 
     def add_remote(self, url, name='origin'):
-        proc = run(['git', 'remote', 'add', f'{name}', f'{url}'], capture_output=True, cwd=self.path)
+        proc = self._git(['remote', 'add', f'{name}', f'{url}'])
         out, err = proc.stdout, proc.stderr
-        if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        if proc.returncode != 0:
             raise RemoteAlreadyExistsError(name)
         if name == 'origin':
             self.origin = url
@@ -49,7 +380,7 @@ class Repo():
 
     def branch(self):
         try:
-            proc = run(['git', 'branch'], capture_output=True, cwd=self.path)
+            proc = self._git(['branch'])
             out, err = proc.stdout, proc.stderr
             branches = out.decode('utf-8')
             return branches
@@ -57,33 +388,28 @@ class Repo():
             return None
     
     def checkout(self, name, new=False):
-        if new == True and name not in self.branches:
-            proc = run(['git', 'checkout', '-b', f'{name}'], capture_output=True, cwd=self.path)
-            err = proc.stderr
-            if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        exists = name in self.branches
+        if new == True and not exists:
+            proc = self._git(['checkout', '-b', f'{name}'])
+            if proc.returncode != 0:
                 raise BranchAlreadyExistsError(name)
-            self.branches.append(name)
-        elif new == False and name in self.branches:
-            proc = run(['git', 'checkout', f'{name}'], capture_output=True, cwd=self.path)
-            err = proc.stderr
-            if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        elif new == False and exists:
+            proc = self._git(['checkout', f'{name}'])
+            if proc.returncode != 0:
                 raise BranchNotExistsError(name)
-        elif new == True and name in self.branches:
+        elif new == True and exists:
             raise BranchAlreadyExistsError(name)
-        elif new == False and name not in self.branches:
+        elif new == False and not exists:
             raise BranchNotExistsError(name)
-        self.current_branch = name
         return True
     
     change_branch = checkout
 
     def delete_branch(self, name):
         if name in self.branches:
-            proc = run(['git', 'branch', '-D', f'{name}'], capture_output=True, cwd=self.path)
-            err = proc.stderr
-            if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+            proc = self._git(['branch', '-D', f'{name}'])
+            if proc.returncode != 0:
                 raise CannotDeleteBranchError(name)
-            self.branches.remove(name)
             return True
         else:
             raise CannotDeleteBranchError(name)
@@ -91,72 +417,123 @@ class Repo():
     def merge(self, branch, commit=True):
         self.commit(message=f'About to merge {branch}')
         if commit == False:
-            proc = run(['git', 'merge', '--no-commit', branch], capture_output=True, cwd=self.path)
-            out, err = proc.stdout, proc.stderr
-            print(out.decode('utf-8'))
-            print(err.decode('utf-8'))
-            if 'not something we can merge' in err.decode('utf-8') or 'error:' in err.decode('utf-8') or 'fatal:' in err.decode('utf-8'):
-                raise MergeError(branch)
-            elif 'Merge conflict' in err.decode('utf-8'):
-                raise ConflictError
+            proc = self._git(['merge', '--no-commit', branch])
         else:
-            proc = run(['git', 'merge', branch], capture_output=True, cwd=self.path)
-            out, err = proc.stdout, proc.stderr
-            print(out.decode('utf-8'))
-            print(err.decode('utf-8'))
-            if 'not something we can merge' in err.decode('utf-8') or 'error:' in err.decode('utf-8') or 'fatal:' in err.decode('utf-8'):
-                raise MergeError(branch)
-            elif 'Merge conflict' in err.decode('utf-8'):
+            proc = self._git(['merge', branch])
+        out, err = proc.stdout, proc.stderr
+        print(out.decode('utf-8'))
+        print(err.decode('utf-8'))
+        if proc.returncode != 0:
+            if 'CONFLICT' in out.decode('utf-8') or 'Merge conflict' in err.decode('utf-8'):
                 raise ConflictError
+            raise MergeError(branch)
         return True
     
     def abort_merge(self):
-        proc = run(['git', 'merge', '--abort'], capture_output=True,cwd=self.path)
+        proc = self._git(['merge', '--abort'])
         out, err = proc.stdout, proc.stderr
         print(out.decode('utf-8'))
         print(err.decode('utf-8'))
-        if 'fatal' in err.decode('utf-8'):
+        if proc.returncode != 0:
             raise MergeError(branch='No merge to abort')
         return True
     
     def continue_merge(self):
-        proc = run(['git', 'merge', '--continue'], capture_output=True, cwd=self.path)
+        proc = self._git(['merge', '--continue'])
         out, err = proc.stdout, proc.stderr
         print(out.decode('utf-8'))
         print(err.decode('utf-8'))
-        if 'Merge conflict' in err.decode('utf-8'):
-            raise ConflictError
+        if proc.returncode != 0:
+            if 'unmerged' in err.decode('utf-8') or 'Merge conflict' in err.decode('utf-8'):
+                raise ConflictError
+            raise MergeError(branch='No merge to continue')
         return True
+
+    def preview_merge(self, ours, theirs, allow_unrelated=False):
+        ours, theirs = self.commit_sha(ours), self.commit_sha(theirs)
+        command = ['merge-tree', '--write-tree', '-z', '--messages']
+        if allow_unrelated == True:
+            command.append('--allow-unrelated-histories')
+        proc = self._git(command + [ours, theirs])
+        # 0 is a clean merge and 1 a merge with conflicts; anything else is an error
+        if proc.returncode not in (0, 1):
+            raise MergeError(theirs, message=_git_error(proc.stderr.decode('utf-8'), 'Cannot merge the commits'))
+        return _parse_merge_tree(ours, theirs, proc.stdout, proc.returncode == 0)
+
+    def preview_merges(self, pairs, workers=8, allow_unrelated=False):
+        # Resolve everything first, so a bad revision fails before any merge runs
+        pairs = [(self.commit_sha(ours), self.commit_sha(theirs)) for ours, theirs in pairs]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda pair: self.preview_merge(*pair, allow_unrelated=allow_unrelated), pairs))
         
     def stage_files(self):
-        try:
-            proc = run(['git', 'add', '-A'], capture_output=True, cwd=self.path)
-            out, err = proc.stdout, proc.stderr
-            files = out.decode('utf-8')
-            errors = err.decode('utf-8')
-            return True
-        except:
-            return False
+        proc = self._git(['add', '-A'])
+        return proc.returncode == 0
     
     add = stage_files
 
+    def stage(self, paths, literal=True):
+        command = ['add', '-A', '--pathspec-from-file=-', '--pathspec-file-nul']
+        if literal == True:
+            command.insert(0, '--literal-pathspecs')
+        data = _pathspec_input(paths)
+        if not data:
+            return True
+        proc = self._git(command, input=data)
+        if proc.returncode != 0:
+            raise _stage_error(proc.stderr.decode('utf-8'), paths)
+        return True
+
+    def stage_blobs(self, blobs, mode=FILE_MODE):
+        data = _index_info(blobs, mode)
+        if not data:
+            return True
+        proc = self._git(['update-index', '-z', '--index-info'], input=data)
+        if proc.returncode != 0:
+            raise _stage_error(proc.stderr.decode('utf-8'), blobs)
+        return True
+
+    def unstage(self, paths, literal=True):
+        data = _pathspec_input(paths)
+        if not data:
+            return True
+        try:
+            self.resolve('HEAD')
+            command = ['reset', '-q', '--pathspec-from-file=-', '--pathspec-file-nul']
+        except UnknownRevisionError:
+            # Nothing to reset to before the first commit, so drop the paths from the index instead
+            command = ['rm', '-r', '-q', '--cached', '--ignore-unmatch', '--pathspec-from-file=-', '--pathspec-file-nul']
+        if literal == True:
+            command.insert(0, '--literal-pathspecs')
+        proc = self._git(command, input=data)
+        if proc.returncode != 0:
+            raise _stage_error(proc.stderr.decode('utf-8'), paths)
+        return True
+
     def remove_files(self, cached=False, pathspec=None, recursive=False):
-        if cached == False and pathspec == None:
-            proc = run(['git', 'rm'], capture_output=True,  cwd=self.path)
+        if pathspec != None and not isinstance(pathspec, str):
+            command = ['rm', '--pathspec-from-file=-', '--pathspec-file-nul']
+            if recursive == True:
+                command.insert(1, '-r')
+            if cached == True:
+                command.insert(1, '--cached')
+            proc = self._git(command, input=_pathspec_input(pathspec))
+        elif cached == False and pathspec == None:
+            proc = self._git(['rm'])
         elif cached == True and pathspec == None:
-            proc = run(['git', 'rm', '--cached'], capture_output=True,  cwd=self.path)
+            proc = self._git(['rm', '--cached'])
         elif cached == False and pathspec != None and recursive == False:
-            proc = run(['git', 'rm', f'{pathspec}'], capture_output=True,  cwd=self.path)
+            proc = self._git(['rm', f'{pathspec}'])
         elif cached == False and pathspec != None and recursive == True:
-            proc = run(['git', 'rm', '-r', f'{pathspec}'], capture_output=True,  cwd=self.path)
+            proc = self._git(['rm', '-r', f'{pathspec}'])
         elif cached == True and pathspec != None and recursive == False:
-            proc = run(['git', 'rm', '--cached', f'{pathspec}'], capture_output=True,  cwd=self.path)
+            proc = self._git(['rm', '--cached', f'{pathspec}'])
         elif cached == True and pathspec != None and recursive == True:
-            proc = run(['git', 'rm', '-r', '--cached', f'{pathspec}'], capture_output=True,  cwd=self.path)
+            proc = self._git(['rm', '-r', '--cached', f'{pathspec}'])
         else:
             return False
         out, err = proc.stdout, proc.stderr
-        if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        if proc.returncode != 0:
             raise RemoveFailureError
         files = out.decode('utf-8')
         return True
@@ -164,15 +541,20 @@ class Repo():
     def commit(self, add=True, message=None):
         try:
             if add == True and message != None:
-                proc = run(['git', 'commit', '-am', f'{message}'], capture_output=True)
+                proc = self._git(['commit', '-am', f'{message}'])
             elif add == False and message != None:
-                proc = run(['git', 'commit', '-m', f'{message}'], capture_output=True)
+                proc = self._git(['commit', '-m', f'{message}'])
             elif add == True and message == None:
-                proc = run(['git', 'commit', '-a', '--allow-empty-message'], capture_output=True)
+                proc = self._git(['commit', '-a', '--allow-empty-message'])
             else:
-                proc = run(['git', 'commit', '--allow-empty-message'], capture_output=True)
-            commit_hash = re.search('\w{40}', self.log(1)).group()
-            ct = {'name': message, 'hash': str(commit_hash)}
+                proc = self._git(['commit', '--allow-empty-message'])
+            if proc.returncode != 0:
+                # Nothing to commit, no identity configured, a failing hook and so on
+                print((proc.stdout + proc.stderr).decode('utf-8').strip())
+                return False
+            commit_hash = self.resolve('HEAD')
+            ct = {'name': message, 'hash': commit_hash}
+            self._positions[ct['hash']] = len(self.commits)
             self.commits.append(ct)
             self.latest_commit = ct
             return True
@@ -180,39 +562,283 @@ class Repo():
             print(e)
             return False
     
+    def commit_builder(self, ref=None, parent=None):
+        return CommitBuilder(self, ref=ref, parent=parent)
+
+    def worktree_pool(self, size=4, directory=None, clean=True):
+        return WorktreePool(self, size=size, directory=directory, clean=clean)
+
+    def update_refs(self, updates, message=None):
+        updates = list(updates)
+        command = ['update-ref', '--stdin']
+        if message != None:
+            command.extend(['-m', f'{message}'])
+        proc = self._git(command, input=_update_ref_input(updates))
+        if proc.returncode != 0:
+            raise _ref_update_error(proc.stderr.decode('utf-8'), updates)
+        return True
+
     def log(self, limit=None, format=None):
         if limit == None and format == None:
-            proc = run(['git', 'log'], capture_output=True, cwd=self.path)
+            proc = self._git(['log'])
         elif limit!= None and isinstance(limit, int) and format == None:
-            proc = run(['git', 'log', '-n', f'{limit}'], capture_output=True, cwd=self.path)
+            proc = self._git(['log', '-n', f'{limit}'])
         elif limit == None and format != None:
-            proc = run(['git', 'log', f'--pretty=format:{format}'], capture_output=True, cwd=self.path)
+            proc = self._git(['log', f'--pretty=format:{format}'])
         elif limit != None and isinstance(limit, int) and format != None:
-            proc = run(['git', 'log', '-n', f'{limit}', f'--pretty=format:{format}'], capture_output=True, cwd=self.path)
+            proc = self._git(['log', '-n', f'{limit}', f'--pretty=format:{format}'])
         else:
             return None
         out, err = proc.stdout, proc.stderr
-        if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        if proc.returncode != 0:
             raise NoCommitsError
         commits = out.decode('utf-8')
         return commits
     
+    def iter_log(self, rev=None, paths=None, since=None, until=None, limit=None, after=None):
+        if limit != None and limit <= 0:
+            # git treats a negative --max-count as no limit at all
+            return
+        command = ['log', '-z', f'--pretty=tformat:{LOG_FORMAT}']
+        if limit != None and after == None:
+            # When resuming, the commits before 'after' don't count towards the limit
+            command.append(f'--max-count={limit}')
+        if since != None:
+            command.append(f'--since={_log_date(since)}')
+        if until != None:
+            command.append(f'--until={_log_date(until)}')
+        if rev == None:
+            pass
+        elif isinstance(rev, str):
+            command.append(rev)
+        else:
+            command.extend(rev)
+        command.append('--')
+        if paths != None:
+            command.extend([paths] if isinstance(paths, str) else paths)
+
+        proc = self.runner.popen(command, cwd=self.path, stdout=PIPE, stderr=PIPE)
+        try:
+            skipping = after != None
+            remaining = limit if after != None else None
+            fields = []
+            pending = b''
+            while True:
+                chunk = proc.stdout.read1(READ_CHUNK)
+                if not chunk:
+                    break
+                proc.invocation.bytes_out += len(chunk)
+                parts = (pending + chunk).split(b'\0')
+                pending = parts.pop()
+                for part in parts:
+                    fields.append(part)
+                    if len(fields) < LOG_FIELDS:
+                        continue
+                    if skipping:
+                        # Resuming a previous walk: drop everything up to and including 'after'
+                        skipping = not fields[0].decode('ascii').startswith(after)
+                        fields = []
+                        continue
+                    commit = _parse_commit([field.decode('utf-8', 'replace') for field in fields])
+                    fields = []
+                    yield commit
+                    if remaining != None:
+                        remaining -= 1
+                        if remaining == 0:
+                            # Stopping here kills git in the finally block below
+                            return
+            err = proc.stderr.read().decode('utf-8')
+            if proc.wait() != 0:
+                if 'does not have any commits' in err:
+                    raise NoCommitsError
+                raise UnknownRevisionError(rev, message='Cannot read the log of a revision that does not exist')
+            if skipping:
+                raise UnknownRevisionError(after, message='The commit to continue after is not in the log')
+        finally:
+            if proc.poll() == None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+            self.runner.finish(proc.invocation, proc.returncode)
+
+    def _commit_tree(self, commit):
+        return self.read_object(commit).data.split(b'\n', 1)[0].split()[1].decode('ascii')
+
+    def tree_sha(self, rev):
+        if HEX_SHA.fullmatch(rev):
+            try:
+                if self.read_object(rev).type == 'tree':
+                    return rev.lower()
+            except ObjectNotFoundError:
+                pass
+        try:
+            return self._commit_tree(self.commit_sha(rev))
+        except UnknownRevisionError:
+            proc = self._git(['rev-parse', '--verify', '--quiet', f'{rev}^{{tree}}'])
+            if proc.returncode != 0:
+                raise UnknownRevisionError(rev, message='Revision does not exist or is not a tree')
+            return proc.stdout.decode('utf-8').strip()
+
+    def diff(self, a, b=None, renames=False):
+        if b == None:
+            # Compare a commit with its first parent, like `git show`
+            commit = self.commit_sha(a)
+            parents = parse_commit(self.read_object(commit).data)[0]
+            tree_a = self._commit_tree(parents[0]) if parents else EMPTY_TREE
+            tree_b = self._commit_tree(commit)
+        else:
+            tree_a, tree_b = self.tree_sha(a), self.tree_sha(b)
+        key = (tree_a, tree_b, renames)
+        cached = self._diffs.get(key)
+        if cached != None:
+            return iter(cached)
+        return self._stream_diff(key)
+
+    def _stream_diff(self, key):
+        tree_a, tree_b, renames = key
+        command = ['diff-tree', '-r', '-z', '--raw', '--numstat']
+        if renames == True:
+            command.append('-M')
+        command.extend([tree_a, tree_b])
+        proc = self.runner.popen(command, cwd=self.path, stdout=PIPE, stderr=PIPE)
+        try:
+            parser = DiffParser()
+            entries = []
+            pending = b''
+            while True:
+                chunk = proc.stdout.read1(READ_CHUNK)
+                if not chunk:
+                    break
+                proc.invocation.bytes_out += len(chunk)
+                parts = (pending + chunk).split(b'\0')
+                pending = parts.pop()
+                for part in parts:
+                    entry = parser.feed(part)
+                    if entry != None:
+                        entries.append(entry)
+                        yield entry
+            proc.stderr.read()
+            if proc.wait() != 0:
+                raise UnknownRevisionError(f'{tree_a}..{tree_b}', message='Cannot diff trees that do not exist')
+            # Only complete diffs are cached
+            self._diffs.put(key, entries)
+        finally:
+            if proc.poll() == None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+            self.runner.finish(proc.invocation, proc.returncode)
+
+    def grep(self, pattern, revs=None, paths=None, threads=None, max_matches=None, ignore_case=False, fixed=False,
+             cache=False):
+        if revs == None:
+            revs = ['HEAD']
+        elif isinstance(revs, str):
+            revs = [revs]
+        if isinstance(paths, str):
+            paths = [paths]
+        # Revisions are searched by commit hash, so every match can be traced back
+        # to the names it was asked for under
+        names = {}
+        for rev in revs:
+            names.setdefault(self.commit_sha(rev), []).append(rev)
+        options = (pattern, ignore_case, fixed, tuple(paths) if paths != None else None)
+        keys = {sha: (self._commit_tree(sha),) + options for sha in names} if cache == True else {}
+        return self._stream_grep(names, keys, options, threads, max_matches)
+
+    def _stream_grep(self, names, keys, options, threads, max_matches):
+        pattern, ignore_case, fixed, paths = options
+        found = 0
+        search = []
+        for sha in names:
+            cached = self._greps.get(keys[sha]) if sha in keys else None
+            if cached == None:
+                search.append(sha)
+                continue
+            for path, line, text in cached:
+                for rev in names[sha]:
+                    if max_matches != None and found >= max_matches:
+                        return
+                    found += 1
+                    yield GrepMatch(rev, path, line, text)
+        if not search or (max_matches != None and found >= max_matches):
+            return
+        command = ['grep', '-z', '-n', '-I', '--no-color', '-F' if fixed == True else '-E']
+        if ignore_case == True:
+            command.append('-i')
+        if threads != None:
+            command.append(f'--threads={int(threads)}')
+        command.extend(['-e', pattern] + search + ['--'])
+        if paths != None:
+            command.extend(paths)
+        proc = self.runner.popen(command, cwd=self.path, stdout=PIPE, stderr=PIPE)
+        try:
+            parser = GrepParser()
+            results = {sha: [] for sha in search if sha in keys}
+            while True:
+                chunk = proc.stdout.read1(READ_CHUNK)
+                if not chunk:
+                    break
+                proc.invocation.bytes_out += len(chunk)
+                for sha, path, line, text in parser.feed(chunk):
+                    if sha in results:
+                        results[sha].append((path, line, text))
+                    for rev in names[sha]:
+                        if max_matches != None and found >= max_matches:
+                            # Stopping early leaves the results incomplete, so nothing is cached
+                            return
+                        found += 1
+                        yield GrepMatch(rev, path, line, text)
+            err = proc.stderr.read().decode('utf-8')
+            # 1 means nothing matched
+            if proc.wait() not in (0, 1):
+                raise GrepError(pattern, message=_git_error(err, 'Cannot search for the pattern'))
+            for sha, matches in results.items():
+                self._greps.put(keys[sha], matches)
+        finally:
+            if proc.poll() == None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+            self.runner.finish(proc.invocation, proc.returncode)
+
     def status(self, short=False, porcelain=False, untracked=False):
+        if short:
+            command = ['status', '--short']
+        elif porcelain:
+            command = ['status', '--porcelain']
+        elif untracked:
+            command = ['status', '-u']
+        else:
+            command = ['status']
         try:
-            if short:
-                proc = run(['git', 'status', '--short'], capture_output=True, cwd=self.path)
-            elif porcelain:
-                proc = run(['git', 'status', '--porcelain'], capture_output=True, cwd=self.path)
-            elif untracked:
-                proc = run(['git', 'status', '-u'], capture_output=True, cwd=self.path)
-            else:
-                proc = run(['git', 'status'], capture_output=True, cwd=self.path)
-            out, err = proc.stdout, proc.stderr
-            status = out.decode('utf-8')
-            return status
-        except:
-            return None
-    
+            proc = self._git(command)
+        except OSError:
+            # The path itself doesn't exist
+            raise NotRepositoryError(self.path)
+        if proc.returncode != 0:
+            raise NotRepositoryError(self.path, message=_git_error(proc.stderr.decode('utf-8'), 'Folder is not a git repository'))
+        return proc.stdout.decode('utf-8')
+
+    def worktree_status(self, untracked=True):
+        if self.native:
+            if self._scanner == None:
+                git_dir = find_git_dir(self.path)
+                self._scanner = StatusScanner(self.path, git_dir, find_common_dir(git_dir))
+            try:
+                return self._scanner.scan(self.runner, untracked=untracked)
+            except UnsupportedIndex:
+                # e.g. a split index; git can always read its own index
+                pass
+        proc = self._git(['status', '--porcelain', '-z', '--ignore-submodules=all',
+                          '--untracked-files=all' if untracked else '--untracked-files=no'])
+        if proc.returncode != 0:
+            raise NotRepositoryError(self.path, message=_git_error(proc.stderr.decode('utf-8'), 'Folder is not a git repository'))
+        return _parse_porcelain(proc.stdout)
+
     def gitignore(self, content=[]):
         try:
             if len(content) == 0:
@@ -237,72 +863,124 @@ class Repo():
     ignore = gitignore
 
     def reset(self, mode, commit):
-        proc = run(['git', 'reset', f'--{mode}', f'{commit}'], capture_output=True, cwd=self.path)
+        proc = self._git(['reset', f'--{mode}', f'{commit}'])
         out, err = proc.stdout, proc.stderr
-        if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        if proc.returncode != 0:
             raise UnknownRevisionError(commit)
-        for i in self.commits:
-            commit_hash = i['hash'][:len(commit)]
-            if commit == commit_hash:
-                name = i['name']
-                new_hash = i['hash']
-                break
-        ct = {'name': name, 'hash': new_hash}
-        self.latest_commit = ct
-        index = self.commits.index(ct) + 1
-        self.commits = self.commits[:index]
+        new_hash = self.resolve('HEAD')
+        position = self._positions.get(new_hash)
+        if position != None and position < len(self.commits) and self.commits[position]['hash'] == new_hash:
+            for ct in self.commits[position + 1:]:
+                self._positions.pop(ct['hash'], None)
+            self.commits = self.commits[:position + 1]
+            self.latest_commit = self.commits[position]
+        else:
+            # Reset to a commit that wasn't made through this object, so none of
+            # the recorded commits can be relied on to still be in the history
+            self.commits = []
+            self._positions = {}
+            self.latest_commit = {'name': None, 'hash': new_hash}
         return True
     
-    def push(self, username, password, remote='origin', branch='master', all=False):
-        rest = remote.replace(re.search('.*.com', remote).group(), '')
-        site = re.search('/.*.com', remote).group()
-        site = site.replace('//', '')
-
-        command = remote[:8] + username + ':' + password + '@' + site
-        if platform.system == 'Windows':
-            file = open(f'{self.path}\.git-credentials', 'a')
-        else:
-            file = open(f'{self.path}/.git-credentials', 'a')
-        
-        file.write(f'{command}')
-        file.close()
+    def _git_progress(self, args, progress, source=None):
+        if progress == None:
+            proc = self._git(args)
+            return proc.returncode, proc.stderr.decode('utf-8')
+        # git only reports progress to a terminal unless asked to
+        args = list(args)
+        args.insert(args.index(subcommand(args)) + 1, '--progress')
+        # Only stderr is read, so stdout is discarded rather than left to fill its pipe
+        proc = self.runner.popen(args, cwd=self.path, stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE)
+        reader = ProgressReader(progress, source)
+        try:
+            while True:
+                chunk = proc.stderr.read1(READ_CHUNK)
+                if not chunk:
+                    break
+                proc.invocation.bytes_out += len(chunk)
+                reader.feed(chunk)
+            proc.wait()
+        finally:
+            if proc.poll() == None:
+                proc.kill()
+                proc.wait()
+            proc.stderr.close()
+            self.runner.finish(proc.invocation, proc.returncode)
+        return proc.returncode, reader.close()
 
-        with open('.gitignore', 'a') as f:
-            f.write('.git-credentials')
-        
+    def push(self, username=None, password=None, remote='origin', branch='master', all=False, progress=None):
+        if username != None and password != None:
+            _store_credentials(self.path, remote, username, password)
 
         if all == True:
-            proc = run(['git', 'push', '-u', remote, '--all', branch], capture_output=True, cwd=self.path)
+            code, err = self._git_progress(['push', '-u', remote, '--all', branch], progress, remote)
         else:
-            proc = run(['git', 'push', '-u', remote, f'HEAD:{branch}'], capture_output=True, cwd=self.path)
+            code, err = self._git_progress(['push', '-u', remote, f'HEAD:{branch}'], progress, remote)
         
-        out, err = proc.stdout, proc.stderr
-        if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+        if code != 0:
             raise PushError(remote, branch)
         
         return True
 
-    def pull(self, remote, username, password, branch=None):
-        rest = remote.replace(re.search('.*.com', remote).group(), '')
-        site = re.search('/.*.com', remote).group()
-        site = site.replace('//', '')
-
-        command = remote[:8] + username + ':' + password + '@' + site + rest
+    def pull(self, remote, username=None, password=None, branch=None, progress=None):
+        command = remote
+        if username != None and password != None:
+            command = _authenticated_url(remote, username, password)
         if branch != None:
-            proc = run(['git', 'pull', f'{command}', f'{branch}'], capture_output=True, cwd=self.path)
+            code, err = self._git_progress(['pull', f'{command}', f'{branch}'], progress, remote)
         else:
-            proc = run(['git', 'pull', f'{command}', 'master'], capture_output=True, cwd=self.path)
-        out, err = proc.stdout, proc.stderr
-        if 'fatal' in err.decode('utf-8') or 'error' in err.decode('utf-8'):
+            code, err = self._git_progress(['pull', f'{command}', 'master'], progress, remote)
+        if code != 0:
             raise PullError
         return True
 
+    def fetch(self, remotes=None, jobs=None, negotiation=None, negotiation_tips=None, prune=False, progress=None):
+        options = []
+        if negotiation != None:
+            if negotiation not in NEGOTIATION_ALGORITHMS:
+                raise ValueError(f'negotiation must be one of {", ".join(NEGOTIATION_ALGORITHMS)}')
+            options.extend(['-c', f'fetch.negotiationAlgorithm={negotiation}'])
+        options.append('fetch')
+        if prune == True:
+            options.append('--prune')
+        if negotiation_tips != None:
+            # Only these refs are offered to the remote as commits we already have
+            for tip in [negotiation_tips] if isinstance(negotiation_tips, str) else negotiation_tips:
+                options.append(f'--negotiation-tip={tip}')
+        if isinstance(remotes, str):
+            code, err = self._git_progress(options + [remotes], progress, remotes)
+            if code != 0:
+                raise FetchError(remotes, message=_git_error(err, 'Fetching from remote failed'))
+            return True
+        if progress == None:
+            # Let git fetch from up to jobs remotes at once (fetch.parallel)
+            command = options + [f'--jobs={int(jobs)}'] if jobs != None else list(options)
+            command.extend(['--all'] if remotes == None else ['--multiple', *remotes])
+            code, err = self._git_progress(command, None)
+            if code != 0:
+                raise FetchError('all remotes' if remotes == None else ', '.join(remotes),
+                                 message=_git_error(err, 'Fetching from remote failed'))
+            return True
+        # git's own parallel fetch doesn't pass on transfer progress, so start one
+        # fetch per remote instead and tag each update with the remote it came from
+        if remotes == None:
+            remotes = self._git(['remote']).stdout.decode('utf-8').split()
+        failed = []
+        with ThreadPoolExecutor(max_workers=jobs or 1) as pool:
+            results = pool.map(lambda remote: (remote, self._git_progress(options + [remote], progress, remote)), remotes)
+            for remote, (code, err) in results:
+                if code != 0:
+                    failed.append(remote)
+        if failed:
+            raise FetchError(', '.join(failed))
+        return True
+
 def init(path):
     try:
         if not os.path.exists(path):
             os.mkdir(path)
         
-        initproc = run(['git', 'init'],  cwd=path)
+        initproc = default_runner.run(['init'], cwd=path)
         repo = Repo(path)
         repo.commit(message="Repository Created")
         return repo
@@ -312,37 +990,82 @@ def init(path):
 def set_identity(name, email, globalreach=False):
     try:
         if globalreach == True:
-            name_proc = run(['git', 'config', '--global', 'user.name', f'"{name}"'], capture_output=True)
-            email_proc = run(['git', 'config', '--global', 'user.email', f'{email}'], capture_output=True)
+            name_proc = default_runner.run(['config', '--global', 'user.name', f'"{name}"'])
+            email_proc = default_runner.run(['config', '--global', 'user.email', f'{email}'])
             out, err = name_proc.stdout, name_proc.stderr
         elif globalreach == False:
-            name_proc = run(['git', 'config', 'user.name', f'"{name}"'], capture_output=True)
-            email_proc = run(['git', 'config', 'user.email', f'{email}'], capture_output=True)
+            name_proc = default_runner.run(['config', 'user.name', f'"{name}"'])
+            email_proc = default_runner.run(['config', 'user.email', f'{email}'])
             out, err = name_proc.stdout, name_proc.stderr
         return True
     except:
         return False
 
-def clone(path, remote, username, password, branch=None):
-    try:
-        rest = remote.replace(re.search('.*.com', remote).group(), '')
-        site = re.search('/.*.com', remote).group()
-        site = site.replace('//', '')
+def _clone_url(remote, transport):
+    if not os.path.isdir(remote):
+        return remote
+    # git runs inside path, so local repositories are made absolute first. git
+    # copies or hard-links those and ignores --depth and --filter, so when either
+    # is asked for, the file:// transport is used instead
+    if transport:
+        return pathlib.Path(remote).resolve().as_uri()
+    return os.path.abspath(remote)
 
-        command = remote[:8] + username + ':' + password + '@' + site + rest
-        if branch != None:
-            proc = run(['git', 'clone', '-b', f'{branch}', f'{command}'], cwd=path)
-        else:
-            proc = run(['git', 'clone', f'{command}'], cwd=path)
-        repo = Repo(path)
-        origin = remote
-        return repo
-    except:
+def _clone_directory(remote):
+    '''The directory name git picks when none is given, e.g. 'repo' for host:org/repo.git'''
+    name = remote.rstrip('/')
+    if name.endswith('/.git'):
+        name = name[:-len('/.git')]
+    elif name.endswith('.git'):
+        name = name[:-len('.git')]
+    return re.split('[/:]', name)[-1]
+
+def clone(path, remote, username=None, password=None, branch=None, directory=None, filter=None,
+          depth=None, shallow_since=None, reference=None, dissociate=False, sparse=None):
+    mode = CloneMode(filter, depth, shallow_since, reference, dissociate,
+                     [sparse] if isinstance(sparse, str) else sparse)
+    url = _clone_url(remote, filter != None or depth != None or shallow_since != None)
+    if username != None and password != None:
+        url = _authenticated_url(url, username, password)
+    command = ['clone']
+    if branch != None:
+        command.extend(['-b', f'{branch}'])
+    if filter != None:
+        command.append(f'--filter={filter}')
+    if depth != None:
+        command.append(f'--depth={int(depth)}')
+    if shallow_since != None:
+        command.append(f'--shallow-since={_log_date(shallow_since)}')
+    if reference != None:
+        command.extend(['--reference', os.path.abspath(reference) if os.path.isdir(reference) else f'{reference}'])
+        if dissociate == True:
+            command.append('--dissociate')
+    if mode.sparse != None:
+        command.append('--sparse')
+    command.extend(['--', url])
+    if directory != None:
+        command.append(f'{directory}')
+    if not os.path.exists(path):
+        os.makedirs(path)
+    proc = default_runner.run(command, cwd=path)
+    if proc.returncode != 0:
         return False
+    if directory == None:
+        match = re.search("Cloning into '(.*)'", proc.stderr.decode('utf-8'))
+        directory = match.group(1) if match != None else _clone_directory(remote)
+    repo = Repo(os.path.join(path, directory), origin=remote)
+    repo.clone_mode = mode
+    if mode.sparse != None:
+        # Cone patterns are directories; pass them on stdin so any number can be given
+        patterns = ''.join(f'{pattern}\n' for pattern in mode.sparse).encode('utf-8')
+        proc = repo._git(['sparse-checkout', 'set', '--cone', '--stdin'], input=patterns)
+        if proc.returncode != 0:
+            return False
+    return repo
 
 def help():
     try:
-        proc = run(['git', 'help'], capture_output=True)
+        proc = default_runner.run(['help'])
         out, err = proc.stdout, proc.stderr
         info = out.decode('utf-8')
         print(info)
@@ -0,0 +1,52 @@
+import os
+from .exceptions import NotRepositoryError
+
+def find_git_dir(path):
+    '''Returns the git directory for the repository at path, following
+    `.git` files (linked worktrees, submodules) and accepting bare repositories'''
+    dotgit = os.path.join(path, '.git')
+    if os.path.isdir(dotgit):
+        return dotgit
+    if os.path.isfile(dotgit):
+        with open(dotgit, 'r') as file:
+            content = file.read().strip()
+        if content.startswith('gitdir:'):
+            return os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+    if os.path.isfile(os.path.join(path, 'HEAD')) and os.path.isdir(os.path.join(path, 'objects')):
+        return path
+    raise NotRepositoryError(path)
+
+def find_common_dir(git_dir):
+    '''Returns the directory holding the objects and shared refs, which
+    differs from the git directory for linked worktrees'''
+    commondir = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir):
+        with open(commondir, 'r') as file:
+            return os.path.normpath(os.path.join(git_dir, file.read().strip()))
+    return git_dir
+
+def config_value(common_dir, section, key):
+    '''Returns the value of section.key from the user and repository config
+    files, or None when it isn't set. Later files override earlier ones, as
+    in git. Includes and subsections aren't followed.'''
+    home = os.path.expanduser('~')
+    xdg = os.environ.get('XDG_CONFIG_HOME') or os.path.join(home, '.config')
+    found = None
+    for config in (os.path.join(xdg, 'git', 'config'), os.path.join(home, '.gitconfig'),
+                   os.path.join(common_dir, 'config')):
+        try:
+            with open(config, 'r', encoding='utf-8', errors='surrogateescape') as file:
+                text = file.read()
+        except OSError:
+            continue
+        current = None
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('['):
+                current = line[1:line.find(']')].strip().lower()
+            elif current == section and line and line[0] not in '#;':
+                name, equals, value = line.partition('=')
+                if name.strip().lower() == key:
+                    # A key without a value is a boolean set to true
+                    found = value.strip().strip('"') if equals else 'true'
+    return found
@@ -0,0 +1,357 @@
+import binascii
+import heapq
+import mmap
+import os
+import struct
+import threading
+
+GRAPH_SIGNATURE = b'CGPH'
+CHUNK_OIDF = b'OIDF'
+CHUNK_OIDL = b'OIDL'
+CHUNK_CDAT = b'CDAT'
+CHUNK_EDGE = b'EDGE'
+
+PARENT_NONE = 0x70000000
+EXTRA_EDGES = 0x80000000
+LAST_EDGE = 0x80000000
+
+PARENT1 = 1
+PARENT2 = 2
+STALE = 4
+RESULT = 8
+
+
+class CommitGraphFile():
+    '''One memory-mapped commit-graph file (a whole graph or one layer of a chain)'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] != GRAPH_SIGNATURE:
+            raise ValueError(f'{path} is not a commit-graph file')
+        version, hash_version, chunks, self.base_graphs = struct.unpack_from('>BBBB', self.map, 4)
+        if version != 1 or hash_version != 1:
+            raise ValueError(f'unsupported commit-graph version in {path}')
+        self.chunks = {}
+        for i in range(chunks):
+            chunk_id = self.map[8 + i * 12:12 + i * 12]
+            self.chunks[chunk_id] = struct.unpack_from('>Q', self.map, 12 + i * 12)[0]
+        self.fanout = struct.unpack_from('>256I', self.map, self.chunks[CHUNK_OIDF])
+        self.count = self.fanout[255]
+        self.oids = self.chunks[CHUNK_OIDL]
+        self.data = self.chunks[CHUNK_CDAT]
+        self.edges = self.chunks.get(CHUNK_EDGE)
+
+    def find(self, binsha):
+        first = binsha[0]
+        lo = self.fanout[first - 1] if first else 0
+        hi = self.fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self.map[self.oids + mid * 20:self.oids + mid * 20 + 20]
+            if name < binsha:
+                lo = mid + 1
+            elif name > binsha:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def oid(self, pos):
+        return self.map[self.oids + pos * 20:self.oids + pos * 20 + 20]
+
+    def entry(self, pos):
+        '''Returns (parent positions, generation, commit date) for the commit at pos'''
+        parent1, parent2, high, low = struct.unpack_from('>IIII', self.map, self.data + pos * 36 + 20)
+        generation = high >> 2
+        date = ((high & 0x3) << 32) | low
+        parents = []
+        if parent1 != PARENT_NONE:
+            parents.append(parent1)
+        if parent2 & EXTRA_EDGES and parent2 != PARENT_NONE:
+            edge = parent2 & ~EXTRA_EDGES
+            while True:
+                value = struct.unpack_from('>I', self.map, self.edges + edge * 4)[0]
+                parents.append(value & ~LAST_EDGE)
+                if value & LAST_EDGE:
+                    break
+                edge += 1
+        elif parent2 != PARENT_NONE:
+            parents.append(parent2)
+        return parents, generation, date
+
+    def close(self):
+        self.map.close()
+
+
+class CommitGraph():
+    '''The commit-graph of an object directory, either a single file or a chain of layers'''
+
+    def __init__(self, objects_dir):
+        info = os.path.join(objects_dir, 'info')
+        self.layers = []
+        single = os.path.join(info, 'commit-graph')
+        chain = os.path.join(info, 'commit-graphs', 'commit-graph-chain')
+        if os.path.isfile(chain):
+            with open(chain, 'r') as file:
+                for line in file:
+                    if line.strip():
+                        self.layers.append(CommitGraphFile(os.path.join(info, 'commit-graphs', f'graph-{line.strip()}.graph')))
+        elif os.path.isfile(single):
+            self.layers.append(CommitGraphFile(single))
+        self.offsets = []
+        total = 0
+        for layer in self.layers:
+            self.offsets.append(total)
+            total += layer.count
+
+    def _layer(self, pos):
+        for i in range(len(self.layers) - 1, -1, -1):
+            if pos >= self.offsets[i]:
+                return self.layers[i], pos - self.offsets[i]
+
+    def lookup(self, sha):
+        '''Returns (parents, generation, date) for sha, or None if it isn't in the graph'''
+        binsha = binascii.unhexlify(sha)
+        for layer, offset in zip(self.layers, self.offsets):
+            pos = layer.find(binsha)
+            if pos != None:
+                parents, generation, date = layer.entry(pos)
+                names = []
+                for parent in parents:
+                    parent_layer, parent_pos = self._layer(parent)
+                    names.append(binascii.hexlify(parent_layer.oid(parent_pos)).decode('ascii'))
+                return names, generation, date
+        return None
+
+    def close(self):
+        for layer in self.layers:
+            layer.close()
+        self.layers = []
+
+
+def parse_commit(data):
+    '''Returns (parents, committer date) from raw commit object data'''
+    parents = []
+    date = 0
+    for line in data.split(b'\n'):
+        if not line:
+            break
+        if line.startswith(b'parent '):
+            parents.append(line[7:].decode('ascii'))
+        elif line.startswith(b'committer '):
+            date = int(line.rsplit(b' ', 2)[1])
+    return parents, date
+
+
+class AncestryIndex():
+    '''Reachability queries over the commit-graph file. Commits the graph doesn't
+    cover are parsed from their objects and given generation numbers (topological
+    levels, as in the graph) in an in-memory cache, so the generation-ordered walks
+    below stay exact either way.'''
+
+    def __init__(self, objects_dir, read_commit):
+        self.objects_dir = objects_dir
+        self.read_commit = read_commit
+        self.lock = threading.Lock()
+        self.signature = None
+        self.graph = None
+        self.cache = {}
+
+    def _signature(self):
+        info = os.path.join(self.objects_dir, 'info')
+        signature = []
+        for path in [os.path.join(info, 'commit-graph'), os.path.join(info, 'commit-graphs', 'commit-graph-chain')]:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_ino, st.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self):
+        signature = self._signature()
+        with self.lock:
+            if signature == self.signature:
+                return
+            if self.graph != None:
+                self.graph.close()
+            self.graph = CommitGraph(self.objects_dir)
+            self.signature = signature
+
+    def _lookup(self, sha):
+        entry = self.graph.lookup(sha) if self.graph != None else None
+        if entry == None:
+            parents, date = parse_commit(self.read_commit(sha))
+            # A generation of 0 means "unknown", as in graphs written by old versions of git
+            entry = (parents, 0, date)
+        return entry
+
+    def info(self, sha):
+        '''Returns (parents, generation, date) for a commit'''
+        cache = self.cache
+        if sha in cache:
+            return cache[sha]
+        pending = {}
+        stack = [sha]
+        while stack:
+            top = stack[-1]
+            if top in cache:
+                stack.pop()
+                continue
+            if top not in pending:
+                pending[top] = self._lookup(top)
+            parents, generation, date = pending[top]
+            if not generation:
+                missing = [parent for parent in parents if parent not in cache]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                generation = 1 + max([cache[parent][1] for parent in parents], default=0)
+            cache[top] = (parents, generation, date)
+            del pending[top]
+            stack.pop()
+        return cache[sha]
+
+    def parents(self, sha):
+        self.refresh()
+        return self.info(sha)[0]
+
+    def generation(self, sha):
+        self.refresh()
+        return self.info(sha)[1]
+
+    def _key(self, sha):
+        _, generation, date = self.info(sha)
+        return (-generation, -date, sha)
+
+    def is_ancestor(self, ancestor, descendant):
+        '''True if ancestor is reachable from descendant'''
+        return self.is_ancestor_many([(ancestor, descendant)])[0]
+
+    def is_ancestor_many(self, pairs):
+        '''Answers many (ancestor, descendant) questions in a single walk. Each
+        descendant gets its own bit, which is pushed down to its ancestors.'''
+        self.refresh()
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        bits = {}
+        for _, descendant in pairs:
+            bits.setdefault(descendant, 1 << len(bits))
+        targets = set(ancestor for ancestor, _ in pairs)
+        min_generation = min(self.info(ancestor)[1] for ancestor in targets)
+        flags = dict(bits)
+        queue = [self._key(sha) for sha in bits]
+        heapq.heapify(queue)
+        while queue:
+            sha = heapq.heappop(queue)[2]
+            value = flags[sha]
+            for parent in self.info(sha)[0]:
+                if flags.get(parent, 0) | value == flags.get(parent, 0):
+                    continue
+                flags[parent] = flags.get(parent, 0) | value
+                # Nothing below the lowest target's generation can reach it
+                if self.info(parent)[1] >= min_generation:
+                    heapq.heappush(queue, self._key(parent))
+        return [bool(flags.get(ancestor, 0) & bits[descendant]) for ancestor, descendant in pairs]
+
+    def merge_bases(self, one, twos):
+        '''All best common ancestors of one and any of twos, like `git merge-base --all`'''
+        self.refresh()
+        if one in twos:
+            return [one]
+        flags = {one: PARENT1}
+        for two in twos:
+            flags[two] = flags.get(two, 0) | PARENT2
+        queue = []
+        queued = set()
+        nonstale = [0]
+
+        def push(sha):
+            if sha not in queued:
+                queued.add(sha)
+                heapq.heappush(queue, self._key(sha))
+                if not flags[sha] & STALE:
+                    nonstale[0] += 1
+
+        for sha in flags:
+            push(sha)
+        results = []
+        while nonstale[0]:
+            sha = heapq.heappop(queue)[2]
+            queued.discard(sha)
+            value = flags[sha]
+            if not value & STALE:
+                nonstale[0] -= 1
+            paint = value & (PARENT1 | PARENT2 | STALE)
+            if paint == PARENT1 | PARENT2:
+                if not value & RESULT:
+                    flags[sha] |= RESULT
+                    results.append(sha)
+                paint |= STALE
+            for parent in self.info(sha)[0]:
+                old = flags.get(parent, 0)
+                if old & paint == paint:
+                    continue
+                flags[parent] = old | paint
+                if parent in queued and paint & STALE and not old & STALE:
+                    nonstale[0] -= 1
+                push(parent)
+        results = [sha for sha in results if not flags[sha] & STALE]
+        if len(results) > 1:
+            # Drop any result that is an ancestor of another result
+            pairs = [(a, b) for a in results for b in results if a != b]
+            redundant = set(a for (a, b), found in zip(pairs, self.is_ancestor_many(pairs)) if found)
+            results = [sha for sha in results if sha not in redundant]
+        return results
+
+    def ahead_behind_many(self, base, tips):
+        '''Returns (ahead, behind) counts of every tip relative to base in one walk'''
+        self.refresh()
+        tips = list(tips)
+        flags = {base: 1}
+        for i, tip in enumerate(tips):
+            flags[tip] = flags.get(tip, 0) | (2 << i)
+        full = (2 << len(tips)) - 1
+        queue = []
+        queued = set()
+        partial = [0]
+
+        def push(sha):
+            if sha not in queued:
+                queued.add(sha)
+                heapq.heappush(queue, self._key(sha))
+                if flags[sha] != full:
+                    partial[0] += 1
+
+        for sha in list(flags):
+            push(sha)
+        # Once everything left in the queue is reachable from all starting points,
+        # the rest of history adds nothing to any count
+        while partial[0]:
+            sha = heapq.heappop(queue)[2]
+            queued.discard(sha)
+            value = flags[sha]
+            if value != full:
+                partial[0] -= 1
+            for parent in self.info(sha)[0]:
+                old = flags.get(parent, 0)
+                if old | value == old:
+                    continue
+                flags[parent] = old | value
+                if parent in queued and old != full and flags[parent] == full:
+                    partial[0] -= 1
+                push(parent)
+        counts = []
+        for i in range(len(tips)):
+            bit = 2 << i
+            ahead = behind = 0
+            for value in flags.values():
+                if value & bit and not value & 1:
+                    ahead += 1
+                elif value & 1 and not value & bit:
+                    behind += 1
+            counts.append((ahead, behind))
+        return counts
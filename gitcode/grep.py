@@ -0,0 +1,43 @@
+from collections import namedtuple
+from .diff import DiffCache
+
+GrepMatch = namedtuple('GrepMatch', ['rev', 'path', 'line', 'text'])
+
+
+class GrepParser():
+    '''Splits `git grep -z -n` output for whole commits into (sha, path, line,
+    text) records. Each record is "<sha>:<path>", NUL, the line number, NUL and
+    the matching line up to a newline, so paths may hold any character.'''
+
+    def __init__(self):
+        self.pending = b''
+        self.fields = []
+
+    def feed(self, chunk):
+        '''Takes a chunk of output and returns the records it completed'''
+        data = self.pending + chunk
+        records = []
+        pos = 0
+        while True:
+            if len(self.fields) < 2:
+                end = data.find(b'\0', pos)
+            else:
+                end = data.find(b'\n', pos)
+            if end == -1:
+                break
+            self.fields.append(data[pos:end])
+            pos = end + 1
+            if len(self.fields) == 3:
+                name, line, text = self.fields
+                self.fields = []
+                # Commits are passed as full hashes, so the name is always "<40 hex>:<path>"
+                records.append((name[:40].decode('ascii'), name[41:].decode('utf-8', 'surrogateescape'),
+                                int(line), text.decode('utf-8', 'replace')))
+        self.pending = data[pos:]
+        return records
+
+
+class GrepCache(DiffCache):
+    '''An LRU of complete search results keyed by (tree, pattern, options,
+    paths), bounded by the total number of matches it holds. Like diffs,
+    results for a tree never go stale.'''
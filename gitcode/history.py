@@ -0,0 +1,235 @@
+from subprocess import PIPE, DEVNULL
+import datetime
+import os
+import sqlite3
+import threading
+from .exceptions import *
+from .git import Commit, READ_CHUNK
+from .gitdir import find_git_dir, find_common_dir
+
+HISTORY_FORMAT = '%x01%H%x00%P%x00%an%x00%ae%x00%at%x00%cn%x00%ce%x00%ct%x00%B'
+HISTORY_FIELDS = 9
+SCHEMA_VERSION = 1
+INSERT_BATCH = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS commits (
+    sha TEXT PRIMARY KEY,
+    parents TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    author_email TEXT NOT NULL,
+    author_time INTEGER NOT NULL,
+    committer_name TEXT NOT NULL,
+    committer_email TEXT NOT NULL,
+    commit_time INTEGER NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS commits_time ON commits (commit_time);
+CREATE INDEX IF NOT EXISTS commits_author_name ON commits (author_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS commits_author_email ON commits (author_email COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS changes (
+    sha TEXT NOT NULL,
+    path_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (path_id, sha)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS changes_sha ON changes (sha);
+CREATE TABLE IF NOT EXISTS tips (
+    sha TEXT PRIMARY KEY
+);
+'''
+
+def _timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    return int(value)
+
+def _like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class HistoryIndex():
+    '''A SQLite copy of a repository's commit history (metadata, messages and
+    touched paths) for answering queries without walking history. Each update
+    only reads commits reachable from the current tips but not from the tips
+    indexed last time, so keeping it current costs one short `git log`.'''
+
+    def __init__(self, repo, path=None, auto_update=True):
+        self.repo = repo
+        if path == None:
+            path = os.path.join(find_common_dir(find_git_dir(repo.path)), 'gitcode-history.sqlite')
+        self.path = path
+        self.auto_update = auto_update
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(f'{path} was written by an incompatible version of gitcode')
+        self.db.executescript(SCHEMA)
+        self.db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _tips(self, revs):
+        if revs == None:
+            tips = set(self.repo.refs.branches.values())
+            try:
+                tips.add(self.repo.resolve('HEAD'))
+            except UnknownRevisionError:
+                pass
+            return tips
+        return set(self.repo.commit_sha(rev) for rev in revs)
+
+    def update(self, revs=None):
+        '''Indexes every commit reachable from revs (default: all branches and HEAD)
+        that isn't indexed yet. Returns the number of commits added.'''
+        with self.lock:
+            tips = self._tips(revs)
+            known = set(row[0] for row in self.db.execute('SELECT sha FROM tips'))
+            new = tips - known
+            if not new:
+                return 0
+            # Tips that have since been garbage collected can't be excluded by git
+            known = [sha for sha, info in zip(known, self.repo.object_info(list(known))) if info != None]
+            added = self._index(new, known)
+            if revs == None:
+                self.db.execute('DELETE FROM tips')
+            self.db.executemany('INSERT OR IGNORE INTO tips (sha) VALUES (?)', [(sha,) for sha in tips])
+            self.db.commit()
+            return added
+
+    def _index(self, include, exclude):
+        command = ['log', '--stdin', '-z', '--raw', '--no-abbrev', '--no-renames', f'--format={HISTORY_FORMAT}']
+        proc = self.repo.runner.popen(command, cwd=self.repo.path, stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        commits, changes = [], []
+        path_ids = {}
+        added = 0
+        try:
+            # git reads every revision from stdin before it starts walking
+            request = ''.join([f'{sha}\n' for sha in include] + [f'^{sha}\n' for sha in exclude]).encode('ascii')
+            proc.stdin.write(request)
+            proc.stdin.close()
+            proc.invocation.bytes_in += len(request)
+            fields = None
+            status = None
+            state = 'commit'
+            pending = b''
+            while True:
+                chunk = proc.stdout.read1(READ_CHUNK)
+                if not chunk:
+                    break
+                proc.invocation.bytes_out += len(chunk)
+                parts = (pending + chunk).split(b'\0')
+                pending = parts.pop()
+                for part in parts:
+                    if state == 'fields':
+                        fields.append(part.decode('utf-8', 'replace'))
+                        if len(fields) == HISTORY_FIELDS:
+                            commits.append(tuple(fields[:4]) + (int(fields[4]),) + tuple(fields[5:7])
+                                           + (int(fields[7]), fields[8].strip()))
+                            state = 'commit'
+                    elif state == 'path':
+                        path = part.decode('utf-8', 'replace')
+                        if path not in path_ids:
+                            path_ids[path] = self._path_id(path)
+                        changes.append((fields[0], path_ids[path], status))
+                        state = 'commit'
+                    elif part.startswith(b'\x01'):
+                        fields = [part[1:].decode('ascii')]
+                        state = 'fields'
+                    elif part.lstrip(b'\n').startswith(b':'):
+                        status = part.decode('ascii').split(' ')[-1]
+                        state = 'path'
+                    if len(commits) >= INSERT_BATCH:
+                        added += self._insert(commits, changes)
+                        commits, changes = [], []
+            if proc.wait() != 0:
+                self.db.rollback()
+                raise UnknownRevisionError(', '.join(include), message='Cannot index history that does not exist')
+            added += self._insert(commits, changes)
+        finally:
+            if proc.poll() == None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            self.repo.runner.finish(proc.invocation, proc.returncode)
+        return added
+
+    def _path_id(self, path):
+        self.db.execute('INSERT OR IGNORE INTO paths (path) VALUES (?)', (path,))
+        return self.db.execute('SELECT id FROM paths WHERE path = ?', (path,)).fetchone()[0]
+
+    def _insert(self, commits, changes):
+        before = self.db.total_changes
+        self.db.executemany('INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', commits)
+        added = self.db.total_changes - before
+        self.db.executemany('INSERT OR IGNORE INTO changes (sha, path_id, status) VALUES (?, ?, ?)', changes)
+        return added
+
+    def query(self, author=None, since=None, until=None, path=None, message=None, limit=None):
+        '''Returns matching commits, newest first. author matches a name or email
+        exactly (ignoring case), path matches a file or anything under a directory
+        and message matches any part of the commit message.'''
+        if self.auto_update:
+            self.update()
+        clauses, params = [], []
+        if author != None:
+            clauses.append('(author_name = ? COLLATE NOCASE OR author_email = ? COLLATE NOCASE)')
+            params.extend([author, author])
+        if since != None:
+            clauses.append('commit_time >= ?')
+            params.append(_timestamp(since))
+        if until != None:
+            clauses.append('commit_time <= ?')
+            params.append(_timestamp(until))
+        if path != None:
+            path = path.strip('/')
+            clauses.append("sha IN (SELECT sha FROM changes WHERE path_id IN "
+                           "(SELECT id FROM paths WHERE path = ? OR path LIKE ? ESCAPE '\\'))")
+            params.extend([path, _like(path) + '/%'])
+        if message != None:
+            clauses.append("message LIKE ? ESCAPE '\\'")
+            params.append('%' + _like(message) + '%')
+        sql = 'SELECT * FROM commits'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY commit_time DESC, sha'
+        if limit != None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [Commit(sha, tuple(parents.split()), *rest[:6], message.split('\n', 1)[0])
+                for sha, parents, *rest, message in rows]
+
+    def message(self, sha):
+        '''Returns the full commit message of an indexed commit'''
+        with self.lock:
+            row = self.db.execute('SELECT message FROM commits WHERE sha = ?', (sha,)).fetchone()
+        if row == None:
+            raise UnknownRevisionError(sha, message='Commit is not in the history index')
+        return row[0]
+
+    def files(self, sha):
+        '''Returns (status, path) for every file an indexed commit changed'''
+        with self.lock:
+            rows = self.db.execute('SELECT status, path FROM changes JOIN paths ON paths.id = changes.path_id '
+                                   'WHERE sha = ? ORDER BY path', (sha,)).fetchall()
+        return rows
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM commits').fetchone()[0]
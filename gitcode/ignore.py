@@ -0,0 +1,139 @@
+import os
+import re
+from .gitdir import config_value
+
+def _translate(pattern):
+    '''Turns a gitignore glob into a regular expression. "*" and "?" stop at "/",
+    "**/" matches any number of directories and a trailing "/**" anything inside.'''
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                before = i == 0 or pattern[i - 1] == '/'
+                if before and pattern.startswith('**/', i):
+                    out.append('(?:.*/)?')
+                    i += 3
+                    continue
+                if before and i + 2 == n:
+                    out.append('.*')
+                    i += 2
+                    continue
+                # Any other run of stars is an ordinary "*"
+                while i < n and pattern[i] == '*':
+                    i += 1
+                out.append('[^/]*')
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                out.append('\\[')
+            else:
+                body = pattern[i + 1:j]
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                out.append('(?!/)[' + body.replace('\\', '\\\\') + ']')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(out) + r'\Z', re.DOTALL)
+
+def parse_ignore(text, base=''):
+    '''Returns the rules in the text of a .gitignore file at directory base (a
+    path relative to the top of the worktree, '' for the top) as a list of
+    (regex, negate, directory_only, anchored, base)'''
+    rules = []
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        # Trailing spaces are dropped unless escaped with a backslash
+        stripped = line.rstrip(' ')
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            stripped += ' '
+        line = stripped
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        directory_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        # A slash anywhere but the end ties the pattern to this directory
+        anchored = '/' in line
+        rules.append((_translate(line.lstrip('/')), negate, directory_only, anchored, base))
+    return rules
+
+def _read(path):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='surrogateescape') as file:
+            return file.read()
+    except OSError:
+        return ''
+
+def _excludes_file(common_dir):
+    '''Finds core.excludesFile in the repository and user config files, falling back
+    to git's default of $XDG_CONFIG_HOME/git/ignore'''
+    found = config_value(common_dir, 'core', 'excludesfile')
+    if found != None:
+        return os.path.expanduser(found)
+    xdg = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(xdg, 'git', 'ignore')
+
+
+class IgnoreMatcher():
+    '''Decides whether untracked paths are ignored, using the same sources and
+    precedence as git: core.excludesFile, then .git/info/exclude, then each
+    .gitignore from the top of the worktree down, with later rules winning.
+    Rules read from .gitignore files are cached until the file changes.'''
+
+    def __init__(self, common_dir):
+        self.base_rules = (parse_ignore(_read(_excludes_file(common_dir)))
+                           + parse_ignore(_read(os.path.join(common_dir, 'info', 'exclude'))))
+        self.cache = {}
+
+    def rules_for(self, parent_rules, directory, path):
+        '''Returns the rules that apply inside directory (relative path), given the
+        rules of its parent and the path of its .gitignore file'''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return parent_rules
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = self.cache.get(path)
+        if cached == None or cached[0] != key:
+            cached = (key, parse_ignore(_read(path), directory))
+            self.cache[path] = cached
+        return parent_rules + cached[1] if cached[1] else parent_rules
+
+    def ignored(self, rules, path, is_dir):
+        '''Whether path (relative to the top of the worktree) is ignored under rules'''
+        name = path.rsplit('/', 1)[-1]
+        for regex, negate, directory_only, anchored, base in reversed(rules):
+            if directory_only and not is_dir:
+                continue
+            if anchored:
+                if base:
+                    if not path.startswith(base + '/'):
+                        continue
+                    target = path[len(base) + 1:]
+                else:
+                    target = path
+            else:
+                target = name
+            if regex.match(target):
+                return not negate
+        return False
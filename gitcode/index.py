@@ -0,0 +1,327 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import stat
+import struct
+import threading
+from .gitdir import config_value
+from .ignore import IgnoreMatcher
+
+IndexEntry = namedtuple('IndexEntry', ['path', 'ctime', 'mtime', 'dev', 'ino', 'mode', 'uid', 'gid', 'size',
+                                       'sha', 'stage', 'assume_valid', 'skip_worktree', 'intent_to_add'])
+
+StatusResult = namedtuple('StatusResult', ['modified', 'deleted', 'untracked'])
+
+INDEX_MAGIC = b'DIRC'
+ENTRY_HEADER = struct.Struct('>10I20sH')
+FLAG_ASSUME_VALID = 0x8000
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE_SHIFT = 12
+NAME_MASK = 0x0fff
+EXTENDED_SKIP_WORKTREE = 0x4000
+EXTENDED_INTENT_TO_ADD = 0x2000
+GITLINK_MODE = 0o160000
+SPARSE_DIR_MODE = 0o040000
+# Extensions a reader must understand (their signatures start with A-Z) that
+# change which entries the index holds
+SPLIT_INDEX = b'link'
+SCAN_WORKERS = 8
+
+
+class UnsupportedIndex(Exception):
+    '''Raised for an index this reader can't interpret, so callers can ask git instead'''
+
+
+def _varint(data, pos):
+    '''Reads the offset encoding index v4 uses for the length of the shared prefix'''
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, pos
+
+def parse_index(data):
+    '''Parses the bytes of a .git/index file (versions 2, 3 and 4) into a list
+    of IndexEntry, in index order. Optional extensions (the cache tree, resolve
+    undo, untracked cache and so on) are skipped; a split index is rejected.'''
+    if len(data) < 12 or data[:4] != INDEX_MAGIC:
+        raise UnsupportedIndex('not an index file')
+    version, count = struct.unpack_from('>II', data, 4)
+    if version not in (2, 3, 4):
+        raise UnsupportedIndex(f'index version {version}')
+    entries = []
+    pos = 12
+    previous = b''
+    for _ in range(count):
+        start = pos
+        (ctime_s, ctime_ns, mtime_s, mtime_ns, dev, ino, mode, uid, gid, size,
+         sha, flags) = ENTRY_HEADER.unpack_from(data, pos)
+        pos += ENTRY_HEADER.size
+        extended = 0
+        if flags & FLAG_EXTENDED:
+            extended = struct.unpack_from('>H', data, pos)[0]
+            pos += 2
+        if version == 4:
+            strip, pos = _varint(data, pos)
+            end = data.index(b'\0', pos)
+            name = previous[:len(previous) - strip] + data[pos:end]
+            pos = end + 1
+        else:
+            length = flags & NAME_MASK
+            end = pos + length if length < NAME_MASK else data.index(b'\0', pos)
+            name = data[pos:end]
+            # Entries are padded with 1-8 NULs to a multiple of 8 bytes
+            pos = start + ((end - start + 8) & ~7)
+        previous = name
+        entries.append(IndexEntry(name.decode('utf-8', 'surrogateescape'), (ctime_s, ctime_ns), (mtime_s, mtime_ns),
+                                  dev, ino, mode, uid, gid, size, sha.hex(), (flags >> FLAG_STAGE_SHIFT) & 3,
+                                  bool(flags & FLAG_ASSUME_VALID), bool(extended & EXTENDED_SKIP_WORKTREE),
+                                  bool(extended & EXTENDED_INTENT_TO_ADD)))
+    # Extensions follow the entries, each a 4 byte signature and a 4 byte size,
+    # until the trailing checksum
+    while pos + 8 <= len(data) - 20:
+        signature, length = struct.unpack_from('>4sI', data, pos)
+        if signature == SPLIT_INDEX:
+            raise UnsupportedIndex('split index')
+        pos += 8 + length
+    return entries
+
+
+class IndexFile():
+    '''The parsed index of a worktree, re-read only when the file changes'''
+
+    def __init__(self, path):
+        self.path = path
+        self.key = None
+        self.entries = []
+        self.by_path = {}
+        self.stat_keys = {}
+        self.directories = set()
+        self.timestamp = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock:
+            try:
+                info = os.stat(self.path)
+            except FileNotFoundError:
+                # A repository without any commits or staged files has no index yet
+                info = None
+            key = None if info == None else (info.st_mtime_ns, info.st_size, info.st_ino, info.st_ctime_ns)
+            if key == self.key and self.key != None:
+                return self
+            entries = []
+            if info != None:
+                with open(self.path, 'rb') as file:
+                    entries = parse_index(file.read())
+            self.entries = entries
+            self.by_path = {}
+            self.stat_keys = {}
+            directories = set()
+            for entry in entries:
+                if entry.stage == 0 or entry.path not in self.by_path:
+                    self.by_path[entry.path] = entry
+                    if _plain(entry):
+                        self.stat_keys[entry.path] = _entry_key(entry)
+                    else:
+                        self.stat_keys.pop(entry.path, None)
+                parent = entry.path
+                while '/' in parent:
+                    parent = parent.rsplit('/', 1)[0]
+                    if parent in directories:
+                        break
+                    directories.add(parent)
+            self.directories = directories
+            self.timestamp = 0 if info == None else info.st_mtime_ns
+            self.key = key
+            return self
+
+
+def _plain(entry):
+    '''Whether an entry is an ordinary file whose stat data can be checked'''
+    return (entry.stage == 0 and not entry.intent_to_add and not entry.assume_valid and not entry.skip_worktree
+            and entry.mode not in (GITLINK_MODE, SPARSE_DIR_MODE))
+
+def _entry_key(entry):
+    '''The (mtime, ctime, size, inode) an unchanged file still has. chmod and chown
+    also change ctime, so a match means the mode and owner are unchanged too.'''
+    return (entry.mtime[0] * 1000000000 + entry.mtime[1], entry.ctime[0] * 1000000000 + entry.ctime[1],
+            entry.size, entry.ino)
+
+def _stat_matches(entry, info):
+    '''Compares the stat data cached in the index with lstat() results, the
+    way git does by default (the index keeps the low 32 bits of each field)'''
+    mtime_s, mtime_ns = divmod(info.st_mtime_ns, 1000000000)
+    ctime_s, ctime_ns = divmod(info.st_ctime_ns, 1000000000)
+    if (mtime_s & 0xffffffff, mtime_ns) != entry.mtime or (ctime_s & 0xffffffff, ctime_ns) != entry.ctime:
+        # git built without nanosecond support stores 0 there
+        if entry.mtime[1] != 0 or entry.ctime[1] != 0:
+            return False
+        if (mtime_s & 0xffffffff, ctime_s & 0xffffffff) != (entry.mtime[0], entry.ctime[0]):
+            return False
+    return (info.st_ino & 0xffffffff == entry.ino and info.st_uid & 0xffffffff == entry.uid
+            and info.st_gid & 0xffffffff == entry.gid and info.st_size & 0xffffffff == entry.size)
+
+def _mode_changed(entry, info, filemode=True):
+    '''Whether the file type changed, or (unless core.fileMode is false) the executable bit'''
+    if stat.S_ISLNK(info.st_mode):
+        return not stat.S_ISLNK(entry.mode)
+    if not stat.S_ISREG(info.st_mode) or not stat.S_ISREG(entry.mode):
+        return True
+    return filemode and bool(info.st_mode & 0o100) != bool(entry.mode & 0o100)
+
+def _config_bool(value, default):
+    if value == None:
+        return default
+    return value.lower() not in ('false', 'no', 'off', '0', '')
+
+
+class StatusScanner():
+    '''Finds modified, deleted and untracked files by comparing the index's
+    cached stat data with the worktree, without running git. Directories are
+    listed with os.scandir on a thread pool. Files whose stat data changed but
+    whose size didn't, and files modified too close to when the index was
+    written to trust their stat data ("racily clean"), are hashed to decide.'''
+
+    def __init__(self, path, git_dir, common_dir, workers=SCAN_WORKERS):
+        self.path = path
+        self.index = IndexFile(os.path.join(git_dir, 'index'))
+        self.common_dir = common_dir
+        self.workers = workers
+        self._ignore = None
+
+    @property
+    def ignore(self):
+        if self._ignore == None:
+            self._ignore = IgnoreMatcher(self.common_dir)
+        return self._ignore
+
+    def _scan_dir(self, directory, rules, ignored, untracked, filemode):
+        '''Lists one directory. Returns (seen tracked paths, changed entries,
+        entries to hash, untracked paths, subdirectories to scan next).'''
+        index = self.index
+        full = os.path.join(self.path, directory) if directory else self.path
+        prefix = directory + '/' if directory else ''
+        seen, changed, suspect, new, subdirectories = [], [], [], [], []
+        if untracked and not ignored:
+            rules = self.ignore.rules_for(rules, directory, os.path.join(full, '.gitignore'))
+        try:
+            listing = list(os.scandir(full))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return seen, changed, suspect, new, subdirectories
+        stat_keys = index.stat_keys
+        timestamp = index.timestamp
+        for item in listing:
+            path = prefix + item.name
+            key = stat_keys.get(path)
+            if key != None and not item.is_dir(follow_symlinks=False):
+                # The common case, an ordinary tracked file, gets one lstat and one comparison
+                seen.append(path)
+                try:
+                    info = item.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if key == (info.st_mtime_ns, info.st_ctime_ns, info.st_size & 0xffffffff, info.st_ino & 0xffffffff):
+                    if info.st_mtime_ns >= timestamp:
+                        suspect.append((index.by_path[path], stat.S_ISLNK(info.st_mode)))
+                    continue
+                entry = index.by_path[path]
+                if _mode_changed(entry, info, filemode):
+                    changed.append(path)
+                elif not _stat_matches(entry, info):
+                    if info.st_size & 0xffffffff != entry.size:
+                        changed.append(path)
+                    else:
+                        suspect.append((entry, stat.S_ISLNK(info.st_mode)))
+                elif info.st_mtime_ns >= timestamp:
+                    suspect.append((entry, stat.S_ISLNK(info.st_mode)))
+                continue
+            if not directory and item.name == '.git':
+                continue
+            try:
+                is_dir = item.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            entry = index.by_path.get(path)
+            if entry != None and not (is_dir and entry.mode != GITLINK_MODE and entry.mode != SPARSE_DIR_MODE):
+                # Conflicts, intent-to-add, submodules and entries git is told not to check
+                seen.append(path)
+                if entry.stage != 0 or entry.intent_to_add:
+                    changed.append(path)
+                continue
+            if is_dir:
+                if path in index.directories:
+                    # Tracked files can live inside ignored directories
+                    subdirectories.append((path, rules, ignored or (untracked and self.ignore.ignored(rules, path, True))))
+                elif untracked and not ignored and not self.ignore.ignored(rules, path, True):
+                    if os.path.exists(os.path.join(item.path, '.git')):
+                        # Another repository: git lists it, but not its contents
+                        new.append(path + '/')
+                    else:
+                        subdirectories.append((path, rules, False))
+            elif untracked and not ignored and not self.ignore.ignored(rules, path, False):
+                new.append(path)
+        return seen, changed, suspect, new, subdirectories
+
+    def _hash(self, suspects, runner):
+        '''Returns the suspects whose content no longer matches the index'''
+        changed = []
+        files = []
+        for entry, is_link in suspects:
+            full = os.path.join(self.path, entry.path)
+            if is_link:
+                # hash-object would follow the link, so hash the target name here
+                try:
+                    target = os.fsencode(os.readlink(full))
+                except OSError:
+                    changed.append(entry.path)
+                    continue
+                if hashlib.sha1(b'blob %d\0' % len(target) + target).hexdigest() != entry.sha:
+                    changed.append(entry.path)
+            elif '\n' in entry.path:
+                changed.append(entry.path)
+            else:
+                files.append(entry)
+        if files:
+            # hash-object applies the same clean filters (e.g. line endings) as git status
+            request = ''.join(f'{entry.path}\n' for entry in files).encode('utf-8', 'surrogateescape')
+            proc = runner.run(['hash-object', '--stdin-paths'], cwd=self.path, input=request)
+            shas = proc.stdout.decode('ascii').split() if proc.returncode == 0 else []
+            if len(shas) != len(files):
+                return changed + [entry.path for entry in files]
+            changed.extend(entry.path for entry, sha in zip(files, shas) if sha != entry.sha)
+        return changed
+
+    def scan(self, runner, untracked=True):
+        index = self.index.refresh()
+        base_rules = self.ignore.base_rules if untracked else []
+        # Read on every scan, as it is cheap and may change between scans
+        filemode = _config_bool(config_value(self.common_dir, 'core', 'filemode'), True)
+        seen, modified, suspects, new = set(), set(), [], set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = [pool.submit(self._scan_dir, '', base_rules, False, untracked, filemode)]
+            while pending:
+                future = pending.pop()
+                dir_seen, dir_changed, dir_suspect, dir_new, subdirectories = future.result()
+                seen.update(dir_seen)
+                modified.update(dir_changed)
+                suspects.extend(dir_suspect)
+                new.update(dir_new)
+                for directory, rules, ignored in subdirectories:
+                    pending.append(pool.submit(self._scan_dir, directory, rules, ignored, untracked, filemode))
+        if suspects:
+            modified.update(self._hash(suspects, runner))
+        deleted = set()
+        for path in index.by_path.keys() - seen:
+            entry = index.by_path[path]
+            if entry.skip_worktree or entry.mode == SPARSE_DIR_MODE:
+                continue
+            if entry.stage != 0:
+                modified.add(path)
+            else:
+                deleted.add(path)
+        return StatusResult(frozenset(modified), frozenset(deleted), frozenset(new))
@@ -0,0 +1,368 @@
+from collections import OrderedDict
+import binascii
+import mmap
+import os
+import struct
+import threading
+import zlib
+from .exceptions import ObjectNotFoundError
+from .catfile import GitObject
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {OBJ_COMMIT: 'commit', OBJ_TREE: 'tree', OBJ_BLOB: 'blob', OBJ_TAG: 'tag'}
+
+IDX_MAGIC = b'\xfftOc'
+INFLATE_CHUNK = 16384
+
+def _inflate(view, pos, size):
+    '''Inflates one zlib stream starting at pos without copying the rest of the pack'''
+    stream = zlib.decompressobj()
+    out = []
+    step = max(INFLATE_CHUNK, size + 64)
+    while not stream.eof:
+        chunk = view[pos:pos + step]
+        if not chunk:
+            raise ValueError('truncated pack entry')
+        out.append(stream.decompress(chunk))
+        pos += len(chunk)
+    data = b''.join(out)
+    if len(data) != size:
+        raise ValueError('pack entry size mismatch')
+    return data
+
+def _delta_size(delta, pos):
+    size = shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+def apply_delta(base, delta):
+    '''Applies a git delta (copy/insert instructions) to base'''
+    src_size, pos = _delta_size(delta, 0)
+    dst_size, pos = _delta_size(delta, pos)
+    if src_size != len(base):
+        raise ValueError('delta base size mismatch')
+    out = bytearray()
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out += base[offset:offset + size]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise ValueError('invalid delta opcode')
+    if len(out) != dst_size:
+        raise ValueError('delta result size mismatch')
+    return bytes(out)
+
+def parse_tree(data):
+    '''Returns (mode, name, sha) for every entry of a raw tree object'''
+    entries = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        mode = data[pos:space].decode('ascii')
+        name = os.fsdecode(data[space + 1:nul])
+        sha = binascii.hexlify(data[nul + 1:nul + 21]).decode('ascii')
+        entries.append((mode, name, sha))
+        pos = nul + 21
+    return entries
+
+
+class BaseCache():
+    '''LRU of resolved delta bases, bounded by the total size of the cached data'''
+
+    def __init__(self, limit=32 * 1024 * 1024):
+        self.limit = limit
+        self.used = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, kind, data):
+        if len(data) > self.limit // 4:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (kind, data)
+            self.used += len(data)
+            while self.used > self.limit:
+                _, (_, old) = self.entries.popitem(last=False)
+                self.used -= len(old)
+
+
+class PackIndex():
+    '''A memory-mapped `.idx` file (version 1 or 2)'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] == IDX_MAGIC:
+            version = struct.unpack_from('>I', self.map, 4)[0]
+            if version != 2:
+                raise ValueError(f'unsupported pack index version {version}')
+            self.version = 2
+            self.fanout_offset = 8
+        else:
+            self.version = 1
+            self.fanout_offset = 0
+        self.fanout = struct.unpack_from('>256I', self.map, self.fanout_offset)
+        self.count = self.fanout[255]
+        names = self.fanout_offset + 256 * 4
+        if self.version == 2:
+            self.names_offset = names
+            self.offsets_offset = names + self.count * 24
+            self.large_offset = self.offsets_offset + self.count * 4
+        else:
+            self.names_offset = names
+
+    def _name(self, i):
+        if self.version == 2:
+            start = self.names_offset + i * 20
+        else:
+            start = self.names_offset + i * 24 + 4
+        return self.map[start:start + 20]
+
+    def _offset(self, i):
+        if self.version == 1:
+            return struct.unpack_from('>I', self.map, self.names_offset + i * 24)[0]
+        offset = struct.unpack_from('>I', self.map, self.offsets_offset + i * 4)[0]
+        if offset & 0x80000000:
+            offset = struct.unpack_from('>Q', self.map, self.large_offset + (offset & 0x7fffffff) * 8)[0]
+        return offset
+
+    def find(self, binsha):
+        '''Binary search within the fanout bucket for binsha, returning its pack offset or None'''
+        first = binsha[0]
+        lo = self.fanout[first - 1] if first else 0
+        hi = self.fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self._name(mid)
+            if name < binsha:
+                lo = mid + 1
+            elif name > binsha:
+                hi = mid
+            else:
+                return self._offset(mid)
+        return None
+
+    def close(self):
+        self.map.close()
+
+
+class Pack():
+    '''A memory-mapped `.pack` file and its index'''
+
+    def __init__(self, path):
+        self.path = path
+        self.index = PackIndex(path[:-len('.pack')] + '.idx')
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def entry(self, offset):
+        '''Returns (type, data position, size, base) for the entry at offset,
+        where base is a pack offset for OFS deltas and a binary sha for REF deltas'''
+        view = self.view
+        c = view[offset]
+        pos = offset + 1
+        kind = (c >> 4) & 7
+        size = c & 0x0f
+        shift = 4
+        while c & 0x80:
+            c = view[pos]
+            pos += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+        base = None
+        if kind == OBJ_OFS_DELTA:
+            c = view[pos]
+            pos += 1
+            distance = c & 0x7f
+            while c & 0x80:
+                c = view[pos]
+                pos += 1
+                distance = ((distance + 1) << 7) | (c & 0x7f)
+            base = offset - distance
+        elif kind == OBJ_REF_DELTA:
+            base = bytes(view[pos:pos + 20])
+            pos += 20
+        return kind, pos, size, base
+
+    def inflate(self, pos, size):
+        return _inflate(self.view, pos, size)
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.index.close()
+
+
+class ObjectStore():
+    '''Read-only access to loose and packed objects without spawning git'''
+
+    def __init__(self, objects_dir, cache_limit=32 * 1024 * 1024):
+        self.objects_dir = objects_dir
+        self.pack_dir = os.path.join(objects_dir, 'pack')
+        self.cache = BaseCache(cache_limit)
+        self.packs = {}
+        self.pack_mtime = None
+        self.lock = threading.Lock()
+        self.alternates = []
+        alternates = os.path.join(objects_dir, 'info', 'alternates')
+        if os.path.isfile(alternates):
+            with open(alternates, 'r') as file:
+                for line in file:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        self.alternates.append(ObjectStore(os.path.join(objects_dir, line), cache_limit))
+        self._scan()
+
+    def _scan(self):
+        '''Picks up packs added (or drops packs removed) since the last scan'''
+        try:
+            mtime = os.stat(self.pack_dir).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            if mtime == self.pack_mtime:
+                return False
+            names = set(name for name in os.listdir(self.pack_dir) if name.endswith('.pack')
+                        and os.path.exists(os.path.join(self.pack_dir, name[:-len('.pack')] + '.idx')))
+            packs = dict(self.packs)
+            for name in set(packs) - names:
+                packs.pop(name).close()
+            for name in names - set(packs):
+                packs[name] = Pack(os.path.join(self.pack_dir, name))
+            self.packs = packs
+            self.pack_mtime = mtime
+            return True
+
+    def _find_packed(self, binsha):
+        for pack in list(self.packs.values()):
+            offset = pack.index.find(binsha)
+            if offset != None:
+                return pack, offset
+        return None
+
+    def _read_loose(self, sha):
+        try:
+            with open(os.path.join(self.objects_dir, sha[:2], sha[2:]), 'rb') as file:
+                raw = zlib.decompress(file.read())
+        except FileNotFoundError:
+            return None
+        header, _, data = raw.partition(b'\0')
+        kind, size = header.decode('ascii').split()
+        return kind, data
+
+    def _read_packed(self, pack, offset):
+        chain = []
+        while True:
+            cached = self.cache.get((pack.path, offset))
+            if cached != None:
+                kind, data = cached
+                break
+            kind, pos, size, base = pack.entry(offset)
+            if kind == OBJ_OFS_DELTA:
+                chain.append((pack, offset, pack.inflate(pos, size)))
+                offset = base
+                continue
+            if kind == OBJ_REF_DELTA:
+                chain.append((pack, offset, pack.inflate(pos, size)))
+                found = self._find_packed(base)
+                if found != None:
+                    pack, offset = found
+                    continue
+                kind, data = self._read(binascii.hexlify(base).decode('ascii'))
+                break
+            kind, data = TYPE_NAMES[kind], pack.inflate(pos, size)
+            if chain:
+                self.cache.put((pack.path, offset), kind, data)
+            break
+        for pack, offset, delta in reversed(chain):
+            data = apply_delta(data, delta)
+            self.cache.put((pack.path, offset), kind, data)
+        return kind, data
+
+    def _read(self, sha):
+        binsha = binascii.unhexlify(sha)
+        for attempt in range(2):
+            found = self._find_packed(binsha)
+            if found != None:
+                return self._read_packed(*found)
+            loose = self._read_loose(sha)
+            if loose != None:
+                return loose
+            # The object may have been packed (and its loose copy pruned) since we last looked
+            if attempt == 0 and not self._scan():
+                break
+        for alternate in self.alternates:
+            try:
+                return alternate._read(sha)
+            except ObjectNotFoundError:
+                pass
+        raise ObjectNotFoundError(sha)
+
+    def read(self, sha):
+        sha = sha.lower()
+        if len(sha) != 40:
+            raise ObjectNotFoundError(sha)
+        try:
+            kind, data = self._read(sha)
+        except (binascii.Error, ValueError, zlib.error):
+            # A damaged object reads as missing, so callers can ask git instead
+            raise ObjectNotFoundError(sha)
+        return GitObject(sha, kind, len(data), data)
+
+    def contains(self, sha):
+        try:
+            binsha = binascii.unhexlify(sha)
+        except (binascii.Error, ValueError):
+            return False
+        if self._find_packed(binsha) != None or os.path.exists(os.path.join(self.objects_dir, sha[:2], sha[2:])):
+            return True
+        return any(alternate.contains(sha) for alternate in self.alternates)
+
+    def close(self):
+        with self.lock:
+            for pack in self.packs.values():
+                pack.close()
+            self.packs = {}
+            self.pack_mtime = None
+        for alternate in self.alternates:
+            alternate.close()
@@ -0,0 +1,66 @@
+from collections import namedtuple
+import codecs
+import re
+
+Progress = namedtuple('Progress', ['source', 'server', 'phase', 'percent', 'current', 'total', 'bytes', 'rate', 'done'])
+
+PROGRESS_LINE = re.compile(r'^(?P<server>remote: )?(?P<phase>[A-Za-z][A-Za-z ]*?):\s+'
+                           r'(?:(?P<percent>\d+)% \((?P<current>\d+)/(?P<total>\d+)\)|(?P<count>\d+))'
+                           r'(?:, (?P<bytes>[\d.]+ (?:[KMGT]?i?B|bytes?))(?: \| (?P<rate>[\d.]+ (?:[KMGT]?i?B|bytes?)/s))?)?'
+                           r'(?P<done>, done\.?)?\s*$')
+
+UNITS = {'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+def _size(value):
+    '''Turns git's human readable sizes ("1.20 MiB", "512.00 KiB/s", "393 bytes") back into bytes'''
+    if value == None:
+        return None
+    number, unit = value.split(' ')
+    return int(float(number) * UNITS.get(unit.replace('/s', ''), 1))
+
+def parse_progress(line, source=None):
+    '''Returns a Progress for one line of git's progress output, or None for any other line.
+    Lines starting with "remote:" describe work done by the server.'''
+    match = PROGRESS_LINE.match(line)
+    if match == None:
+        return None
+    if match.group('percent') != None:
+        percent, current, total = int(match.group('percent')), int(match.group('current')), int(match.group('total'))
+    else:
+        percent, current, total = None, int(match.group('count')), None
+    return Progress(source, match.group('server') != None, match.group('phase'), percent, current, total,
+                    _size(match.group('bytes')), _size(match.group('rate')), match.group('done') != None)
+
+
+class ProgressReader():
+    '''Splits git's stderr into lines as it arrives. Progress updates end in a
+    carriage return rather than a newline, so both count as line ends. Every
+    progress line is passed to the callback; the whole output is kept for
+    error reporting.'''
+
+    def __init__(self, callback, source=None):
+        self.callback = callback
+        self.source = source
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.pending = ''
+        self.output = []
+
+    def feed(self, chunk):
+        text = self.pending + self.decoder.decode(chunk)
+        self.output.append(chunk)
+        lines = re.split('[\r\n]', text)
+        self.pending = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def close(self):
+        self.pending += self.decoder.decode(b'', final=True)
+        if self.pending:
+            self._line(self.pending)
+            self.pending = ''
+        return b''.join(self.output).decode('utf-8', 'replace')
+
+    def _line(self, line):
+        event = parse_progress(line, self.source)
+        if event != None and self.callback != None:
+            self.callback(event)
@@ -0,0 +1,205 @@
+import os
+import re
+import threading
+from .exceptions import UnknownRevisionError
+from .gitdir import find_common_dir
+
+HEX_SHA = re.compile('[0-9a-fA-F]{40}')
+
+# Same lookup order as git's ref_rev_parse_rules
+RESOLVE_RULES = ['{}', 'refs/{}', 'refs/tags/{}', 'refs/heads/{}', 'refs/remotes/{}', 'refs/remotes/{}/HEAD']
+MAX_SYMREF_DEPTH = 5
+
+
+class RefIndex():
+    '''Branches, tags and remote refs read straight from the git directory.
+    The index reloads itself whenever HEAD, packed-refs or any directory under
+    refs/ changes on disk; git always updates these by renaming a lock file
+    into place, which changes the inode and the directory's mtime.'''
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.common_dir = find_common_dir(git_dir)
+        self.lock = threading.Lock()
+        self.signature = None
+        self.refs = {}
+        self.symrefs = {}
+        self.peeled = {}
+        self.head = None
+        self.views = {}
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _signature(self):
+        signature = [self._stat(os.path.join(self.git_dir, 'HEAD')),
+                     self._stat(os.path.join(self.common_dir, 'packed-refs'))]
+        pending = [os.path.join(self.common_dir, 'refs')]
+        while pending:
+            directory = pending.pop()
+            signature.append((directory, self._stat(directory)))
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+            except FileNotFoundError:
+                pass
+        return tuple(signature)
+
+    def _read_packed(self, refs, peeled):
+        try:
+            with open(os.path.join(self.common_dir, 'packed-refs'), 'r') as file:
+                last = None
+                for line in file:
+                    line = line.rstrip('\n')
+                    if not line or line.startswith('#'):
+                        continue
+                    if line.startswith('^'):
+                        if last != None:
+                            peeled[last] = line[1:]
+                        continue
+                    sha, _, name = line.partition(' ')
+                    refs[name] = sha
+                    last = name
+        except FileNotFoundError:
+            pass
+
+    def _read_loose(self, refs, symrefs):
+        root = self.common_dir
+        pending = [os.path.join(root, 'refs')]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    continue
+                if entry.name.endswith('.lock'):
+                    continue
+                name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                try:
+                    with open(entry.path, 'r') as file:
+                        content = file.read().strip()
+                except (FileNotFoundError, IsADirectoryError):
+                    continue
+                if content.startswith('ref:'):
+                    symrefs[name] = content[len('ref:'):].strip()
+                    refs.pop(name, None)
+                elif HEX_SHA.fullmatch(content):
+                    # Loose refs take precedence over packed ones
+                    refs[name] = content
+
+    def _read_head(self):
+        try:
+            with open(os.path.join(self.git_dir, 'HEAD'), 'r') as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, force=False):
+        with self.lock:
+            signature = self._signature()
+            if signature == self.signature and not force:
+                return False
+            refs, symrefs, peeled = {}, {}, {}
+            self._read_packed(refs, peeled)
+            self._read_loose(refs, symrefs)
+            self.refs, self.symrefs, self.peeled = refs, symrefs, peeled
+            self.head = self._read_head()
+            self.views = {}
+            self.signature = signature
+            return True
+
+    def _follow(self, name):
+        for _ in range(MAX_SYMREF_DEPTH):
+            if name in self.refs:
+                return self.refs[name]
+            if name not in self.symrefs:
+                return None
+            name = self.symrefs[name]
+        return None
+
+    def _prefixed(self, prefix):
+        self.refresh()
+        views = self.views
+        if prefix not in views:
+            found = {}
+            for name in set(self.refs) | set(self.symrefs):
+                if name.startswith(prefix):
+                    sha = self._follow(name)
+                    if sha != None:
+                        found[name[len(prefix):]] = sha
+            views[prefix] = found
+        return views[prefix]
+
+    @property
+    def branches(self):
+        return self._prefixed('refs/heads/')
+
+    @property
+    def tags(self):
+        return self._prefixed('refs/tags/')
+
+    @property
+    def remotes(self):
+        return self._prefixed('refs/remotes/')
+
+    @property
+    def head_ref(self):
+        '''The full name of the branch HEAD points at, or None when HEAD is detached'''
+        self.refresh()
+        if self.head != None and self.head.startswith('ref:'):
+            return self.head[len('ref:'):].strip()
+        return None
+
+    @property
+    def current_branch(self):
+        ref = self.head_ref
+        if ref != None and ref.startswith('refs/heads/'):
+            return ref[len('refs/heads/'):]
+        return None
+
+    def peel(self, name):
+        '''Returns the object an annotated tag ref points at, if packed-refs recorded it'''
+        self.refresh()
+        return self.peeled.get(name)
+
+    def _pseudo(self, name):
+        '''Reads HEAD-like files (HEAD, ORIG_HEAD, FETCH_HEAD, ...) from the git directory'''
+        if name == 'HEAD':
+            content = self.head
+        else:
+            try:
+                with open(os.path.join(self.git_dir, name), 'r') as file:
+                    content = file.readline().strip()
+            except (FileNotFoundError, IsADirectoryError):
+                return None
+        if content == None:
+            return None
+        if content.startswith('ref:'):
+            return self._follow(content[len('ref:'):].strip())
+        sha = content[:40]
+        return sha if HEX_SHA.fullmatch(sha) else None
+
+    def resolve(self, name):
+        '''Resolves a ref name the way `git rev-parse` would, returning its sha'''
+        if HEX_SHA.fullmatch(name):
+            return name.lower()
+        self.refresh()
+        for rule in RESOLVE_RULES:
+            candidate = rule.format(name)
+            if candidate.isupper() and '/' not in candidate:
+                sha = self._pseudo(candidate)
+            else:
+                sha = self._follow(candidate)
+            if sha != None:
+                return sha
+        raise UnknownRevisionError(name, message='Cannot resolve a ref that does not exist')
@@ -0,0 +1,176 @@
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
+from collections import namedtuple
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from .exceptions import CommandTimeoutError
+
+CommandRecord = namedtuple('CommandRecord', ['args', 'command', 'cwd', 'returncode', 'duration',
+                                             'bytes_in', 'bytes_out', 'regions'])
+
+# Global options that take a separate value, which must be skipped to find the subcommand
+VALUE_OPTIONS = ('-c', '-C', '--git-dir', '--work-tree', '--namespace', '--config-env')
+
+def subcommand(args):
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+def read_trace2(path):
+    '''Sums the time git spent in each trace2 region, keyed by "category:label"'''
+    regions = {}
+    try:
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('event') == 'region_leave' and 't_rel' in event:
+                    name = f"{event.get('category')}:{event.get('label')}"
+                    regions[name] = regions.get(name, 0.0) + event['t_rel']
+    except FileNotFoundError:
+        pass
+    return regions
+
+
+class CommandStats():
+    '''Running totals for one git subcommand'''
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.duration = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.regions = {}
+
+    def add(self, record):
+        self.calls += 1
+        if record.returncode != 0:
+            self.failures += 1
+        self.duration += record.duration
+        self.bytes_in += record.bytes_in
+        self.bytes_out += record.bytes_out
+        for name, seconds in record.regions.items():
+            self.regions[name] = self.regions.get(name, 0.0) + seconds
+
+    def __repr__(self):
+        return f'CommandStats(calls={self.calls}, failures={self.failures}, duration={self.duration:.6f}, bytes_in={self.bytes_in}, bytes_out={self.bytes_out})'
+
+
+class Invocation():
+    '''Bookkeeping for one git process between Runner.start() and Runner.finish()'''
+
+    def __init__(self, args, cwd, env, trace):
+        self.args = args
+        self.cwd = cwd
+        self.env = env
+        self.trace = trace
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.started = time.perf_counter()
+
+
+class Runner():
+    '''The single place gitcode starts git processes from. Every process is
+    timed and counted per subcommand, and each finished command is passed to
+    any registered hooks (e.g. a profiler or metrics sink).'''
+
+    def __init__(self, git='git', trace2=False):
+        self.git = git
+        self.trace2 = trace2
+        self.hooks = []
+        self.stats = {}
+        self.spawned = 0
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.spawned = 0
+
+    def start(self, args, cwd=None, env=None):
+        with self.lock:
+            self.spawned += 1
+        trace = None
+        if self.trace2:
+            handle, trace = tempfile.mkstemp(prefix='gitcode-trace2-', suffix='.json')
+            os.close(handle)
+            env = dict(os.environ if env == None else env)
+            env['GIT_TRACE2_EVENT'] = trace
+        return Invocation(list(args), cwd, env, trace)
+
+    def finish(self, invocation, returncode):
+        duration = time.perf_counter() - invocation.started
+        regions = {}
+        if invocation.trace != None:
+            regions = read_trace2(invocation.trace)
+            try:
+                os.remove(invocation.trace)
+            except OSError:
+                pass
+        name = subcommand(invocation.args)
+        record = CommandRecord(invocation.args, name, invocation.cwd, returncode, duration,
+                               invocation.bytes_in, invocation.bytes_out, regions)
+        with self.lock:
+            if name not in self.stats:
+                self.stats[name] = CommandStats()
+            self.stats[name].add(record)
+        for hook in list(self.hooks):
+            hook(record)
+        return record
+
+    def run(self, args, cwd=None, input=None, env=None, timeout=None):
+        '''Runs git to completion, returning a CompletedProcess with bytes stdout/stderr'''
+        invocation = self.start(args, cwd=cwd, env=env)
+        try:
+            proc = subprocess.run([self.git, *args], input=input, stdout=PIPE, stderr=PIPE,
+                                  stdin=None if input != None else DEVNULL, cwd=cwd, env=invocation.env, timeout=timeout)
+        except TimeoutExpired:
+            self.finish(invocation, -9)
+            raise CommandTimeoutError(subcommand(args), timeout)
+        except BaseException:
+            # git couldn't be started (e.g. it isn't installed or cwd doesn't exist)
+            self.finish(invocation, None)
+            raise
+        invocation.bytes_in = len(input) if input != None else 0
+        invocation.bytes_out = len(proc.stdout) + len(proc.stderr)
+        self.finish(invocation, proc.returncode)
+        return proc
+
+    def popen(self, args, cwd=None, env=None, **kwargs):
+        '''Starts a long-running or streaming git process. The caller adds to
+        proc.invocation.bytes_in/bytes_out as it talks to the process and calls
+        finish(proc.invocation, proc.returncode) once it has exited.'''
+        invocation = self.start(args, cwd=cwd, env=env)
+        try:
+            proc = Popen([self.git, *args], cwd=cwd, env=invocation.env, **kwargs)
+        except BaseException:
+            self.finish(invocation, None)
+            raise
+        proc.invocation = invocation
+        return proc
+
+    def summary(self):
+        '''Returns the per-subcommand totals, slowest first'''
+        with self.lock:
+            return sorted(self.stats.items(), key=lambda item: item[1].duration, reverse=True)
+
+
+runner = Runner()
@@ -0,0 +1,178 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from .exceptions import *
+from .common import _git_error
+
+
+class Worktree():
+    '''One linked worktree owned by a WorktreePool. repo is a Repo for the
+    worktree's directory, so every Repo method works on the leased checkout.'''
+
+    def __init__(self, path, repo):
+        self.path = path
+        self.repo = repo
+        self.sha = None
+
+    def __repr__(self):
+        return f'Worktree({self.path!r}, sha={self.sha!r})'
+
+
+class WorktreePool():
+    '''Leases checkouts of a repository to concurrent callers. Every worktree is
+    a `git worktree add` of the same repository, so they share one object store.
+    Worktrees are checked out detached (git won't check one branch out twice)
+    and are kept when returned; the next lease force-checks-out its revision and
+    cleans untracked files instead of adding a new worktree. At most size
+    worktrees exist at once, and callers wait for one to be returned after that.'''
+
+    def __init__(self, repo, size=4, directory=None, clean=True):
+        self.repo = repo
+        self.runner = repo.runner
+        self.size = size
+        self.clean = clean
+        self.temporary = directory == None
+        if directory == None:
+            directory = tempfile.mkdtemp(prefix='gitcode-worktrees-')
+        elif not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = os.path.abspath(directory)
+        self.idle = []
+        self.leased = set()
+        self.count = 0
+        self.created = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        with self.condition:
+            return self.count
+
+    def _take(self, sha, timeout):
+        '''Returns an idle worktree (preferring one already at sha), None when
+        there is room for a new one, or raises once timeout runs out'''
+        deadline = None if timeout == None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise WorktreeError(sha, message='The worktree pool is closed')
+                if self.idle:
+                    matching = [worktree for worktree in self.idle if worktree.sha == sha]
+                    worktree = matching[0] if matching else self.idle[-1]
+                    self.idle.remove(worktree)
+                    self.leased.add(worktree)
+                    return worktree
+                if self.count < self.size:
+                    # Reserve the slot now; the worktree is added outside the lock
+                    self.count += 1
+                    return None
+                remaining = None if deadline == None else deadline - time.monotonic()
+                if remaining != None and remaining <= 0:
+                    raise WorktreeError(sha, message='No worktree was returned to the pool in time')
+                self.condition.wait(remaining)
+
+    def _add(self, sha):
+        with self.condition:
+            self.created += 1
+            path = os.path.join(self.directory, f'worktree{self.created}')
+        proc = self.runner.run(['worktree', 'add', '--detach', '--force', path, sha], cwd=self.repo.path)
+        if proc.returncode != 0:
+            message = _git_error(proc.stderr.decode('utf-8'), 'Cannot add a worktree for the revision')
+            raise WorktreeError(sha, message=message)
+        worktree = Worktree(path, type(self.repo)(path, runner=self.runner))
+        worktree.sha = sha
+        return worktree
+
+    def _reset(self, worktree, sha):
+        proc = self.runner.run(['checkout', '--quiet', '--force', '--detach', sha], cwd=worktree.path)
+        if proc.returncode != 0:
+            message = _git_error(proc.stderr.decode('utf-8'), 'Cannot check the revision out in the worktree')
+            raise WorktreeError(sha, message=message)
+        worktree.sha = sha
+        if self.clean:
+            proc = self.runner.run(['clean', '-ffdxq'], cwd=worktree.path)
+            if proc.returncode != 0:
+                raise WorktreeError(sha, message=_git_error(proc.stderr.decode('utf-8'), 'Cannot clean the worktree'))
+
+    def acquire(self, rev, timeout=None):
+        '''Leases a worktree checked out at rev, with any changes left by its last
+        user thrown away. Blocks while every worktree is leased, raising a
+        WorktreeError if timeout seconds pass first.'''
+        sha = self.repo.commit_sha(rev)
+        worktree = self._take(sha, timeout)
+        if worktree == None:
+            try:
+                worktree = self._add(sha)
+            except BaseException:
+                with self.condition:
+                    self.count -= 1
+                    self.condition.notify()
+                raise
+            with self.condition:
+                self.leased.add(worktree)
+            return worktree
+        try:
+            self._reset(worktree, sha)
+        except BaseException:
+            self._discard(worktree)
+            raise
+        return worktree
+
+    def release(self, worktree):
+        with self.condition:
+            self.leased.discard(worktree)
+            discard = self.closed
+            if discard:
+                self.count -= 1
+            else:
+                self.idle.append(worktree)
+                self.condition.notify()
+        if discard:
+            self._remove(worktree)
+            if self.temporary and not self.leased:
+                shutil.rmtree(self.directory, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def lease(self, rev, timeout=None):
+        '''acquire() as a context manager that returns the worktree to the pool afterwards'''
+        worktree = self.acquire(rev, timeout)
+        try:
+            yield worktree
+        finally:
+            self.release(worktree)
+
+    def _discard(self, worktree):
+        '''Removes a worktree that can't be reused, freeing its slot'''
+        with self.condition:
+            self.leased.discard(worktree)
+            self.count -= 1
+            self.condition.notify()
+        self._remove(worktree)
+
+    def _remove(self, worktree):
+        worktree.repo.close()
+        proc = self.runner.run(['worktree', 'remove', '--force', '--force', worktree.path], cwd=self.repo.path)
+        if proc.returncode != 0:
+            shutil.rmtree(worktree.path, ignore_errors=True)
+
+    def close(self):
+        '''Removes every idle worktree. Leased worktrees are removed as they are released.'''
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.count -= len(idle)
+            self.condition.notify_all()
+        for worktree in idle:
+            self._remove(worktree)
+        self.runner.run(['worktree', 'prune'], cwd=self.repo.path)
+        if self.temporary and not self.leased:
+            shutil.rmtree(self.directory, ignore_errors=True)
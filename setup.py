@@ -27,7 +27,7 @@ setup(
         'Source': 'https://github.com/WindJackal/gitcode', 
         'Tracker': 'https://github.com/WindJackal/gitcode',
     }, 
-    packages=find_packages(), 
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']), 
     python_requires='>=3.5', 
     include_package_data=True,
 )
\ No newline at end of file